@@ -3,3 +3,7 @@ from django.apps import AppConfig
 
 class GliffAuthConfig(AppConfig):
     name = "myauth"
+
+    def ready(self):
+        # Connect the signals that keep TeamCounters up to date
+        from . import counters  # noqa: F401
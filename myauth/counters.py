@@ -0,0 +1,118 @@
+# Keeps TeamCounters up to date. Whenever something a counter depends on is created, deleted or changes in a way that
+# matters, we recount just that counter for just that team, in the same transaction as the change (these are rare,
+# reading limits is not)
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import receiver
+from django_etebase.models import Collection
+
+from myauth.models import Team, TeamCounters, UserProfile, Invite
+
+# Counter -> (Model, path from the model to the team, filters)
+COUNTERS = {
+    "users": (UserProfile, "team", dict(is_collaborator=False, is_trusted_service=False)),
+    "collaborators": (UserProfile, "team", dict(is_collaborator=True, is_trusted_service=False)),
+    "pending_user_invites": (Invite, "from_team", dict(is_collaborator=False, accepted_date__isnull=True)),
+    "pending_collaborator_invites": (Invite, "from_team", dict(is_collaborator=True, accepted_date__isnull=True)),
+    "projects": (Collection, "owner__userprofile__team", dict()),
+}
+
+PROFILE_COUNTERS = ["users", "collaborators"]
+INVITE_COUNTERS = ["pending_user_invites", "pending_collaborator_invites"]
+PROJECT_COUNTERS = ["projects"]
+
+
+def count_for_team(counter):
+    model, team_path, filters = COUNTERS[counter]
+    counts = (
+        model.objects.filter(**{team_path: OuterRef("team")}, **filters)
+        .order_by()
+        .values(team_path)
+        .annotate(count=Count("pk"))
+        .values("count")
+    )
+    return Coalesce(Subquery(counts[:1]), 0)
+
+
+def refresh_team_counters(team_ids, counters=COUNTERS.keys()):
+    # One UPDATE for every team, we don't create rows here as the team might be in the middle of being deleted.
+    # The rows are locked first: under READ COMMITTED the UPDATE's counts come from a snapshot taken when it starts,
+    # so two of these racing for the same team could each miss the other's change. Once we hold the lock, anyone
+    # else changing the team has committed (or will recount after us), and the UPDATE sees what they did
+    team_ids = sorted(set(team_ids))
+    with transaction.atomic():
+        list(TeamCounters.objects.select_for_update().filter(team_id__in=team_ids).order_by("team_id").values("pk"))
+        TeamCounters.objects.filter(team_id__in=team_ids).update(
+            **{counter: count_for_team(counter) for counter in counters}
+        )
+
+
+def rebuild_team_counters(team_ids=None):
+    teams = Team.objects.all() if team_ids is None else Team.objects.filter(id__in=team_ids)
+    team_ids = list(teams.values_list("id", flat=True))
+
+    with transaction.atomic():
+        TeamCounters.objects.bulk_create([TeamCounters(team_id=team_id) for team_id in team_ids], ignore_conflicts=True)
+        refresh_team_counters(team_ids)
+
+    return len(team_ids)
+
+
+def get_profile_state(profile):
+    return (profile.team_id, profile.is_collaborator, profile.is_trusted_service)
+
+
+@receiver(pre_save, sender=UserProfile)
+def profile_saving(sender, instance, **kwargs):
+    # What it was before, so we know whether (and which teams) to recount once it's saved
+    instance._counted_state = None
+    if not instance._state.adding:
+        instance._counted_state = (
+            UserProfile.objects.filter(pk=instance.pk).values_list("team_id", "is_collaborator", "is_trusted_service")
+        ).first()
+
+
+@receiver(post_save, sender=UserProfile)
+def profile_saved(sender, instance, **kwargs):
+    before = getattr(instance, "_counted_state", None)
+    after = get_profile_state(instance)
+    if before != after:
+        team_ids = [after[0]] if before is None else [before[0], after[0]]
+        refresh_team_counters(team_ids, PROFILE_COUNTERS)
+
+
+@receiver(post_delete, sender=UserProfile)
+def profile_deleted(sender, instance, **kwargs):
+    refresh_team_counters([instance.team_id], PROFILE_COUNTERS)
+
+
+# Invites are also saved when they are accepted, which stops them being pending
+@receiver(post_save, sender=Invite)
+@receiver(post_delete, sender=Invite)
+def invite_changed(sender, instance, **kwargs):
+    refresh_team_counters([instance.from_team_id], INVITE_COUNTERS)
+
+
+def get_owner_team_ids(collection):
+    return list(UserProfile.objects.filter(user_id=collection.owner_id).values_list("team_id", flat=True))
+
+
+@receiver(post_save, sender=Collection)
+def collection_saved(sender, instance, created, **kwargs):
+    if created:
+        refresh_team_counters(get_owner_team_ids(instance), PROJECT_COUNTERS)
+
+
+# When a collection goes because its owner (or their profile) is being deleted, the profile may be gone by the time
+# the collection is, so we find the team beforehand
+@receiver(pre_delete, sender=Collection)
+def collection_deleting(sender, instance, **kwargs):
+    instance._counted_team_ids = get_owner_team_ids(instance)
+
+
+@receiver(post_delete, sender=Collection)
+def collection_deleted(sender, instance, **kwargs):
+    team_ids = getattr(instance, "_counted_team_ids", None)
+    refresh_team_counters(get_owner_team_ids(instance) if team_ids is None else team_ids, PROJECT_COUNTERS)
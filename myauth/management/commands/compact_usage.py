@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from myauth.usage import compact_usage
+
+
+class Command(BaseCommand):
+    help = "Rolls old Usage up into weekly and monthly rows (this also runs after the nightly storage update)"
+
+    def handle(self, *args, **options):
+        compact_usage()
+        self.stdout.write("Done")
@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand, CommandError
+from myauth.counters import rebuild_team_counters
+from myauth.models import Team
+
+
+class Command(BaseCommand):
+    help = (
+        "Recounts the users, collaborators, pending invites and projects for teams (used to check plan limits). "
+        "These are normally kept up to date automatically, so this is only needed if they've drifted"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("team_ids", nargs="*", type=int, help="Team IDs (all teams if none are given)")
+
+    def handle(self, *args, **options):
+        team_ids = options["team_ids"] or None
+
+        if team_ids is not None:
+            missing = set(team_ids) - set(Team.objects.filter(id__in=team_ids).values_list("id", flat=True))
+            if missing:
+                raise CommandError('Team(s) "%s" do not exist' % ", ".join(str(team_id) for team_id in missing))
+
+        count = rebuild_team_counters(team_ids)
+
+        self.stdout.write("Rebuilt counters for %s team(s)" % count)
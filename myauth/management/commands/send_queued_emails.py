@@ -0,0 +1,41 @@
+from loguru import logger
+from django.conf import settings
+from apscheduler.schedulers.background import BackgroundScheduler
+from django.core.management.base import BaseCommand
+
+from server.outbox import send_queued_emails
+
+
+class Command(BaseCommand):
+    help = "Sends queued emails in the background, every EMAIL_DISPATCH_INTERVAL seconds"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true", help="Send whatever is queued now, then exit")
+
+    def handle(self, *args, **options):
+        if options["once"]:
+            self.stdout.write("Sent %s email(s)" % send_queued_emails())
+            return
+
+        if settings.TEST_MODE:
+            return
+
+        # Each process can run this, they won't send the same emails
+        job_defaults = {"coalesce": True, "max_instances": 1}
+        scheduler = BackgroundScheduler(job_defaults=job_defaults, timezone="UTC")
+
+        scheduler.add_job(
+            send_queued_emails,
+            "interval",
+            seconds=settings.EMAIL_DISPATCH_INTERVAL,
+            id="send_queued_emails",
+            replace_existing=True,
+        )
+        logger.info("Added job: 'send_queued_emails'.")
+
+        try:
+            logger.info("Email scheduler starting..")
+            scheduler.start()
+        except KeyboardInterrupt:
+            logger.info("Email scheduler stopping..")
+            scheduler.shutdown()
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from myauth.models import Billing
+from server.api.billing import sync_billing
+
+
+class Command(BaseCommand):
+    help = (
+        "Copies subscriptions we don't have a copy of yet (teams from before we kept one) from Stripe, so showing "
+        "their plan doesn't need Stripe. Teams that fail are left for next time, or their next plan view"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("team_ids", nargs="*", type=int, help="Team IDs (all unsynced teams if none are given)")
+
+    def handle(self, *args, **options):
+        billings = Billing.objects.filter(synced_date=None)
+        if options["team_ids"]:
+            billings = billings.filter(team_id__in=options["team_ids"])
+
+        synced = failed = 0
+        for billing in billings.iterator():
+            if sync_billing(billing):
+                synced += 1
+            else:
+                failed += 1
+
+        self.stdout.write("Synced %s team(s)" % synced)
+        if failed:
+            # Not an error, so it doesn't hold up the server starting when Stripe is down
+            self.stdout.write("Couldn't sync %s team(s), see the log" % failed)
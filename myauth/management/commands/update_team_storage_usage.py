@@ -1,5 +1,8 @@
-import subprocess
-from datetime import datetime
+import random
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
 
 from loguru import logger
 import stripe
@@ -7,49 +10,170 @@ from django.conf import settings
 from apscheduler.schedulers.background import BackgroundScheduler
 from django_apscheduler.jobstores import DjangoJobStore
 from django.core.management.base import BaseCommand
-from myauth.models import Team, User, Billing, Tier, Usage
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail
-
-import server.emails as email_template
-from server.api.billing import gliff_to_stripe_usage, stripe_to_gliff_usage
+from django.db import transaction
+from django.db.models import OuterRef, Subquery
+from myauth.models import Team, User, Tier, Usage, UserProfile, BillingItem, StripePrice, TeamUsage
+from myauth.storage import scan_storage
+from myauth.usage import compact_usage
+from server.api.auth import invalidate_user
+from server.api.billing import gliff_to_stripe_usage, stripe_to_gliff_usage, sync_subscription
+from server.outbox import queue_email
+from server.ratelimit import TokenBucket
 
 stripe.api_key = settings.STRIPE_SECRET_KEY
 
 
-def update_stripe_usage(subscription_id, storage_price_ids, usage, team_id):
-    # Get the storage price id
-    subscription = stripe.Subscription.retrieve(subscription_id, expand=["items.data.price.tiers"])
-
-    user_price_id, stripe_price_id, tiers = next(
-        (
-            (item.id, item.price["id"], item.price["tiers"])
-            for item in subscription["items"]["data"]
-            if item.price["id"] in storage_price_ids
-        ),
-        None,
+def call_stripe(rate_limit, fn, *args, **kwargs):
+    # Every call to Stripe goes through the one rate limit, and if we still get limited (or can't connect) we back off
+    # and try again. Usage records are "set", not "increment", so repeating one is harmless
+    for attempt in range(settings.STRIPE_MAX_RETRIES + 1):
+        rate_limit.acquire()
+        try:
+            return fn(*args, **kwargs)
+        except (stripe.error.RateLimitError, stripe.error.APIConnectionError) as e:
+            if attempt == settings.STRIPE_MAX_RETRIES:
+                raise
+            delay = min(2**attempt, 30) * random.uniform(0.5, 1.5)
+            logger.warning(f"Stripe call failed ({e.__class__.__name__}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def get_storage_items(teams, storage_price_ids):
+    # Team ID -> (subscription item ID, price tiers) from our copy of their subscription, if we have it
+    items = BillingItem.objects.filter(billing__team__in=teams, stripe_price_id__in=storage_price_ids).values_list(
+        "billing__team_id", "stripe_item_id", "stripe_price_id"
     )
+    prices = StripePrice.objects.in_bulk(storage_price_ids)
+
+    return {
+        team_id: (item_id, prices[price_id].tiers)
+        for (team_id, item_id, price_id) in items
+        if price_id in prices and prices[price_id].tiers
+    }
+
+
+def update_stripe_usage(team, storage_item, storage_price_ids, rate_limit, previous_usage=None):
+    # This runs on the pool, so it only talks to Stripe. Anything for the DB is handed back in the outcome
+    outcome = dict(team_id=team.id, usage=team.usage, status="reported", error=None, subscription=None)
+
+    try:
+        if storage_item is None:
+            # We haven't got a copy of their subscription, so get it (and keep it for next time)
+            subscription = outcome["subscription"] = call_stripe(
+                rate_limit,
+                stripe.Subscription.retrieve,
+                team.billing.subscription_id,
+                expand=["items.data.price.tiers"],
+            )
+
+            storage_item = next(
+                (
+                    (item["id"], item["price"]["tiers"])
+                    for item in subscription["items"]["data"]
+                    if item["price"]["id"] in storage_price_ids
+                ),
+                None,
+            )
 
-    if user_price_id:
-        stripe.SubscriptionItem.create_usage_record(
-            user_price_id,
+        # A price that isn't tiered (tiers is None) isn't one we can report against either
+        if storage_item is None or not storage_item[1]:
+            logger.warning(f"Team {team.id} doesn't have a valid storage price set")
+            outcome["status"] = "no_storage_price"
+            return outcome
+
+        item_id, tiers = storage_item
+        call_stripe(
+            rate_limit,
+            stripe.SubscriptionItem.create_usage_record,
+            item_id,
             action="set",
-            quantity=gliff_to_stripe_usage(usage),
+            quantity=gliff_to_stripe_usage(team.usage),
             timestamp=datetime.now(),
         )
-    else:
-        logger.warning(f"Team {team_id} doesn't have a valid storage price set")
+    except Exception as e:
+        logger.error(f"Error reporting storage usage for team {team.id} - {e}")
+        outcome.update(status="failed", error=str(e))
+        return outcome
+
+    try:
+        alert_storage_usage(team, tiers, previous_usage)
+    except Exception as e:
+        # The usage is reported, this is only the alert
+        logger.error(f"Error checking storage usage for team {team.id} - {e}")
+
+    return outcome
+
 
-    limit = stripe_to_gliff_usage(tiers[0].up_to)
+def alert_storage_usage(team, tiers, previous_usage):
+    # The first tier is what's free
+    if not tiers[0]["up_to"]:
+        return
+    limit = stripe_to_gliff_usage(tiers[0]["up_to"])
 
-    # We probably don't want to alert this _every_ night
-    if usage / limit > 0.9:
+    # Only alert on the night they go over, not every night after
+    if team.usage / limit > 0.9 and (previous_usage is None or previous_usage / limit <= 0.9):
         logger.warning(
-            f"Subscription exceeds 90% of free usage for team {team_id},  (Using {gliff_to_stripe_usage(usage)}Gb)"
+            f"Subscription exceeds 90% of free usage for team {team.id},  (Using {gliff_to_stripe_usage(team.usage)}Gb)"
         )
     else:
-        logger.debug(f"Subscription storage is at {(usage / limit) * 100}% for team {team_id}")
-    return
+        logger.debug(f"Subscription storage is at {(team.usage / limit) * 100}% for team {team.id}")
+
+
+def get_previous_team_usage(team_ids, today):
+    # Team ID -> their usage the last time we ran before today, in one query
+    latest = TeamUsage.objects.filter(team=OuterRef("team"), date__lt=today).order_by("-date").values("date")[:1]
+    return dict(TeamUsage.objects.filter(team_id__in=team_ids, date=Subquery(latest)).values_list("team_id", "usage"))
+
+
+def report_stripe_usage(teams, storage_price_ids, previous_usage=None):
+    """Reports each team's storage to Stripe, a few at a time. Returns what happened for each team"""
+    storage_items = get_storage_items(teams, storage_price_ids)
+    rate_limit = TokenBucket(settings.STRIPE_RATE_LIMIT)
+
+    with ThreadPoolExecutor(max_workers=settings.STRIPE_MAX_CONCURRENCY, thread_name_prefix="stripe_usage") as pool:
+        futures = [
+            (
+                team,
+                pool.submit(
+                    update_stripe_usage,
+                    team,
+                    storage_items.get(team.id),
+                    storage_price_ids,
+                    rate_limit,
+                    (previous_usage or {}).get(team.id),
+                ),
+            )
+            for team in teams
+        ]
+
+    # Each team's result on its own, so nothing one team does can lose the others'
+    outcomes = []
+    for team, future in futures:
+        try:
+            outcomes.append(future.result())
+        except Exception as e:
+            logger.error(f"Error reporting storage usage for team {team.id} - {e}")
+            outcomes.append(dict(team_id=team.id, usage=team.usage, status="failed", error=str(e), subscription=None))
+
+    teams = {team.id: team for team in teams}
+    for outcome in outcomes:
+        subscription = outcome.pop("subscription")
+        if subscription is not None:
+            try:
+                sync_subscription(teams[outcome["team_id"]].billing, subscription)
+            except Exception as e:
+                logger.error(f"Error saving the subscription for team {outcome['team_id']} - {e}")
+
+    statuses = Counter(outcome["status"] for outcome in outcomes)
+    logger.info(
+        f"Reported storage usage to Stripe for {len(outcomes)} teams ({len(storage_items)} from our copy of their "
+        f"subscription): {dict(statuses)}"
+    )
+    failed = [outcome["team_id"] for outcome in outcomes if outcome["status"] == "failed"]
+    if failed:
+        logger.error(f"Failed to report storage usage for teams {failed}")
+
+    return outcomes
 
 
 def suspend_trial_account(team_id):
@@ -66,70 +190,74 @@ def suspend_trial_account(team_id):
         # We want to use our own (non-etebase) flag for this at some point and use some middleware to handle this
         # For now tho, this is crude and effective
         users.update(is_active=False)
+        # .update() doesn't send post_save, so drop any cached logins ourselves
+        for user_id in users.values_list("id", flat=True):
+            invalidate_user(user_id)
 
-        try:
-            message = Mail(
-                from_email="contact@gliff.ai",
-                to_emails=owner_email,
-            )
-
-            message.template_id = email_template.id["free_exceeded_limit"]
-
-            sendgrid_client = SendGridAPIClient(settings.SENDGRID_API_KEY)
-            sendgrid_client.send(message)
-        except Exception as e:
-            logger.error(e)
+        queue_email(owner_email, "free_exceeded_limit")
     except Exception as e:
         logger.error(e)
 
 
 def update_team_storage_usage():
-    data_select = dict()
     logger.info("Updating team storage scheduled start")
-    for row in subprocess.check_output(["du", "-d 1", settings.MEDIA_ROOT]).splitlines():
-
-        try:
-            [usage, user] = row.split()
-
-            user_id = int(user.decode("utf-8").replace(f"{settings.MEDIA_ROOT}/user_", ""))
-
-            if type(user_id) == int:
-                data_select[user_id] = int(usage.decode("utf-8"))
-        except ValueError:
-            pass
-
-    user_ids = data_select.keys()
-
-    logger.info(f"Updating user storage: {data_select}")
+    storage = scan_storage(settings.MEDIA_ROOT, settings.STORAGE_MANIFEST_PATH, workers=settings.STORAGE_SCAN_WORKERS)
 
+    # Users -> their teams, in MB
+    profiles = UserProfile.objects.filter(user_id__in=storage.keys()).values_list("user_id", "team_id")
+    usages = []
     teams = dict()
-    for user in User.objects.all():
-        user_id = str(user.id)
-        if user_id in user_ids:
-            # Add this users usage to their team usage
-            usage = int(round(data_select[user_id] * 10 ** -6))
-            u = Usage.objects.create(user, usage=usage)
-            u.save()
-            teams[user.team.id] = teams.get(user.team.id, 0) + usage
-            logger.info(f"Updated team {user.team.id} with {user_id}: new usage = {teams[user.team.id]}")
+    members = dict()
+    for user_id, team_id in profiles:
+        usage = int(round(storage[user_id] * 10**-6))
+        usages.append(Usage(user_id=user_id, usage=usage))
+        teams[team_id] = teams.get(team_id, 0) + usage
+        members.setdefault(team_id, dict())[str(user_id)] = usage
+
+    logger.info(f"Updating storage for {len(usages)} users in {len(teams)} teams")
+
+    today = datetime.now(tz=timezone.utc).date()
+    previous_usage = get_previous_team_usage(teams.keys(), today)
+
+    with transaction.atomic():
+        Usage.objects.bulk_create(usages)
+        # One UPDATE ... CASE for every team
+        Team.objects.bulk_update([Team(id=team_id, usage=usage) for team_id, usage in teams.items()], ["usage"])
+
+        # If we've already run today, this replaces what we had
+        TeamUsage.objects.filter(team_id__in=teams.keys(), date=today).delete()
+        TeamUsage.objects.bulk_create(
+            [
+                TeamUsage(team_id=team_id, date=today, usage=usage, members=members[team_id])
+                for team_id, usage in teams.items()
+            ]
+        )
 
     # Stripe Price IDs
-    price_ids = Tier.objects.all().values_list("stripe_storage_price_id", flat=True)
+    price_ids = [
+        price_id
+        for price_id in Tier.objects.all().values_list("stripe_storage_price_id", flat=True)
+        if price_id is not None
+    ]
+
+    billed_teams = []
+    for team in Team.objects.filter(id__in=teams.keys()).select_related("billing"):
+        if hasattr(team, "billing"):
+            billed_teams.append(team)
+        elif team.usage < 9000:
+            logger.info(f"Team {team.id} doesn't have billing. Their usage is {team.usage}")
+        else:
+            logger.warning(f"Team {team.id} doesn't have billing. Their usage is {team.usage}")
+            suspend_trial_account(team.id)
+
+    outcomes = report_stripe_usage(billed_teams, price_ids, previous_usage)
 
-    for key in teams:
-        team = Team.objects.get(id=key)
-        team.usage = teams[key]
-        team.save()
+    try:
+        compact_usage()
+    except Exception as e:
+        logger.error(f"Error compacting usage {e}")
 
-        try:
-            subscription_id = team.billing.subscription_id
-            update_stripe_usage(subscription_id, price_ids, team.usage, team.id)
-        except Billing.DoesNotExist:
-            if team.usage < 9000:
-                logger.info(f"Team {team.id} doesn't have billing. Their usage is {team.usage}")
-            else:
-                logger.warning(f"Team {team.id} doesn't have billing. Their usage is {team.usage}")
-                suspend_trial_account(team.id)
+    return outcomes
 
 
 class Command(BaseCommand):
@@ -0,0 +1,33 @@
+# Generated by Django 3.1.4 on 2026-10-18 12:00
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("myauth", "0037_userfeedback"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TeamCounters",
+            fields=[
+                (
+                    "team",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        serialize=False,
+                        to="myauth.team",
+                    ),
+                ),
+                ("users", models.IntegerField(default=0)),
+                ("collaborators", models.IntegerField(default=0)),
+                ("pending_user_invites", models.IntegerField(default=0)),
+                ("pending_collaborator_invites", models.IntegerField(default=0)),
+                ("projects", models.IntegerField(default=0)),
+            ],
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 3.1.4 on 2026-10-18 12:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("myauth", "0038_teamcounters"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="billing",
+            name="synced_date",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.CreateModel(
+            name="StripePrice",
+            fields=[
+                ("id", models.CharField(max_length=255, primary_key=True, serialize=False)),
+                ("unit_amount", models.IntegerField(null=True)),
+                ("tiers", models.JSONField(null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="BillingItem",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("stripe_item_id", models.CharField(max_length=255, unique=True)),
+                ("stripe_price_id", models.CharField(max_length=255)),
+                ("quantity", models.IntegerField(null=True)),
+                (
+                    "billing",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, related_name="items", to="myauth.billing"
+                    ),
+                ),
+            ],
+        ),
+    ]
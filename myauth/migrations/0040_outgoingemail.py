@@ -0,0 +1,31 @@
+# Generated by Django 3.1.4 on 2026-10-18 13:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("myauth", "0039_billing_mirror"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="OutgoingEmail",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("to_email", models.EmailField(max_length=254)),
+                ("template_id", models.CharField(max_length=50)),
+                ("template_data", models.JSONField(null=True)),
+                ("created_date", models.DateTimeField(auto_now_add=True)),
+                ("send_after", models.DateTimeField()),
+                ("attempts", models.IntegerField(default=0)),
+                ("sent_date", models.DateTimeField(blank=True, null=True)),
+                ("last_error", models.TextField(blank=True, default="")),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="outgoingemail",
+            index=models.Index(fields=["sent_date", "send_after"], name="myauth_outg_sent_da_4c39bf_idx"),
+        ),
+    ]
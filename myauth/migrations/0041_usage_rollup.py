@@ -0,0 +1,124 @@
+# Generated by Django 3.1.4 on 2026-10-18 19:28
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+# On Postgres, Usage becomes a table partitioned by month (plus a default partition), so old months can be dropped
+# whole once they've been rolled up. Partitions for the coming months are created by myauth/usage.py
+PARTITION_USAGE = """
+ALTER TABLE myauth_usage RENAME TO myauth_usage_unpartitioned;
+ALTER TABLE myauth_usage_unpartitioned RENAME CONSTRAINT myauth_usage_pkey TO myauth_usage_unpartitioned_pkey;
+
+CREATE TABLE myauth_usage (LIKE myauth_usage_unpartitioned INCLUDING DEFAULTS) PARTITION BY RANGE (date);
+ALTER SEQUENCE myauth_usage_id_seq OWNED BY myauth_usage.id;
+
+-- The partition key has to be part of the primary key
+ALTER TABLE myauth_usage ADD CONSTRAINT myauth_usage_pkey PRIMARY KEY (id, date);
+
+CREATE TABLE myauth_usage_default PARTITION OF myauth_usage DEFAULT;
+
+DO $$
+DECLARE
+    month timestamp;
+BEGIN
+    FOR month IN
+        SELECT generate_series(
+            date_trunc('month', COALESCE((SELECT min(date) FROM myauth_usage_unpartitioned), now()) AT TIME ZONE 'UTC'),
+            date_trunc('month', now() AT TIME ZONE 'UTC') + interval '3 months',
+            interval '1 month'
+        )
+    LOOP
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF myauth_usage FOR VALUES FROM (%L) TO (%L)',
+            'myauth_usage_' || to_char(month, 'YYYY_MM'),
+            month AT TIME ZONE 'UTC',
+            (month + interval '1 month') AT TIME ZONE 'UTC'
+        );
+    END LOOP;
+END $$;
+
+INSERT INTO myauth_usage SELECT * FROM myauth_usage_unpartitioned;
+DROP TABLE myauth_usage_unpartitioned;
+"""
+
+# Back to a plain table, with everything Django expects it to have (the partitions go with the partitioned table)
+UNPARTITION_USAGE = """
+ALTER TABLE myauth_usage RENAME TO myauth_usage_partitioned;
+ALTER TABLE myauth_usage_partitioned RENAME CONSTRAINT myauth_usage_pkey TO myauth_usage_partitioned_pkey;
+
+CREATE TABLE myauth_usage (LIKE myauth_usage_partitioned INCLUDING DEFAULTS);
+ALTER SEQUENCE myauth_usage_id_seq OWNED BY myauth_usage.id;
+ALTER TABLE myauth_usage ADD CONSTRAINT myauth_usage_pkey PRIMARY KEY (id);
+
+INSERT INTO myauth_usage SELECT * FROM myauth_usage_partitioned;
+DROP TABLE myauth_usage_partitioned;
+"""
+
+# The foreign key, and its index, as Django made them. The constraint is added once the rows have been copied, so
+# it's checked then and there, rather than leaving a deferred check queued for every row that was copied (Postgres
+# won't build an index, eg. the one below, while those are pending)
+ADD_USER_FK = """
+CREATE INDEX {index} ON myauth_usage (user_id);
+ALTER TABLE myauth_usage ADD CONSTRAINT {fk} FOREIGN KEY (user_id) REFERENCES myauth_user (id)
+    DEFERRABLE INITIALLY DEFERRED;
+SET CONSTRAINTS ALL IMMEDIATE;
+"""
+
+
+def add_user_fk(apps, schema_editor):
+    Usage = apps.get_model("myauth", "Usage")
+    field = Usage._meta.get_field("user")
+    schema_editor.execute(
+        ADD_USER_FK.format(
+            index=schema_editor.quote_name(schema_editor._create_index_name(Usage._meta.db_table, [field.column])),
+            fk=schema_editor._fk_constraint_name(Usage, field, "_fk_%(to_table)s_%(to_column)s"),  # Already quoted
+        )
+    )
+
+
+def partition_usage(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(PARTITION_USAGE, params=None)  # No params, as it uses % itself
+        add_user_fk(apps, schema_editor)
+
+
+def unpartition_usage(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(UNPARTITION_USAGE, params=None)
+        add_user_fk(apps, schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("myauth", "0040_outgoingemail"),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_usage, unpartition_usage),
+        migrations.CreateModel(
+            name="UsageRollup",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("period", models.CharField(choices=[("week", "week"), ("month", "month")], max_length=5)),
+                ("start_date", models.DateField()),
+                ("usage", models.IntegerField()),
+                ("peak_usage", models.IntegerField()),
+                ("samples", models.IntegerField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name="usage",
+            index=models.Index(fields=["user", "-date"], name="myauth_usag_user_id_4e9600_idx"),
+        ),
+        migrations.AddField(
+            model_name="usagerollup",
+            name="user",
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterUniqueTogether(
+            name="usagerollup",
+            unique_together={("user", "period", "start_date")},
+        ),
+    ]
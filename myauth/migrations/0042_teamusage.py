@@ -0,0 +1,27 @@
+# Generated by Django 3.1.4 on 2026-10-18 19:30
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("myauth", "0041_usage_rollup"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TeamUsage",
+            fields=[
+                ("id", models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("date", models.DateField()),
+                ("usage", models.IntegerField()),
+                ("members", models.JSONField(default=dict)),
+                ("team", models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to="myauth.team")),
+            ],
+            options={
+                "unique_together": {("team", "date")},
+            },
+        ),
+    ]
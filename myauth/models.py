@@ -118,6 +118,23 @@ class Billing(models.Model):
     trial_end = models.DateTimeField(blank=True, null=True)
     subscription_id = models.CharField(max_length=255, blank=True)
     cancel_date = models.DateTimeField(blank=True, null=True)
+    # When we last copied the subscription (dates above, and items below) from Stripe
+    synced_date = models.DateTimeField(blank=True, null=True)
+
+
+# Our copy of the items on a team's Stripe subscription, kept up to date by the Stripe webhook
+class BillingItem(models.Model):
+    billing = models.ForeignKey(Billing, on_delete=models.CASCADE, related_name="items")
+    stripe_item_id = models.CharField(max_length=255, unique=True)
+    stripe_price_id = models.CharField(max_length=255)
+    quantity = models.IntegerField(null=True)  # Metered prices (ie. storage) don't have one
+
+
+# Our copy of the Stripe prices used by subscriptions, kept up to date by the Stripe webhook
+class StripePrice(models.Model):
+    id = models.CharField(max_length=255, primary_key=True)  # The Stripe price ID
+    unit_amount = models.IntegerField(null=True)
+    tiers = models.JSONField(null=True)  # [{"up_to": int | None, "unit_amount": int | None}]
 
 
 class CustomBilling(models.Model):
@@ -136,6 +153,17 @@ class Invite(models.Model):
     accepted_date = models.DateTimeField(blank=True, null=True)
 
 
+# Running totals for a team, so checking their plan limits is a single row read rather than counting everything.
+# These are kept up to date in myauth/counters.py, and can be rebuilt with `manage.py rebuild_team_counters`
+class TeamCounters(models.Model):
+    team = models.OneToOneField(Team, on_delete=models.CASCADE, primary_key=True)
+    users = models.IntegerField(default=0)  # Doesn't include collaborators or trusted services
+    collaborators = models.IntegerField(default=0)
+    pending_user_invites = models.IntegerField(default=0)
+    pending_collaborator_invites = models.IntegerField(default=0)
+    projects = models.IntegerField(default=0)
+
+
 class Recovery(models.Model):
     uid = models.CharField(
         db_index=True, blank=False, null=False, max_length=43, validators=[UidValidator], primary_key=True
@@ -195,11 +223,61 @@ class UserFeedback(models.Model):
     date = models.DateTimeField(auto_now_add=True)
 
 
+# Each user's storage (in MB), written nightly. On Postgres this table is partitioned by month, and after
+# USAGE_DAILY_RETENTION_DAYS these are rolled up into UsageRollup and dropped (see myauth/usage.py)
 class Usage(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     date = models.DateTimeField(auto_now_add=True, blank=False, null=False)
     usage = models.IntegerField(null=False, blank=False)
 
+    class Meta:
+        indexes = [models.Index(fields=["user", "-date"])]
+
+
+# Older Usage, a row per user per week (and later, per month)
+class UsageRollup(models.Model):
+    PERIOD_CHOICES = (
+        ("week", "week"),
+        ("month", "month"),
+    )
+    user = models.ForeignKey(User, on_delete=models.CASCADE)
+    period = models.CharField(max_length=5, choices=PERIOD_CHOICES)
+    start_date = models.DateField()
+    usage = models.IntegerField()  # Average over the period
+    peak_usage = models.IntegerField()
+    samples = models.IntegerField()  # How many daily Usage rows went into this
+
+    class Meta:
+        unique_together = ("user", "period", "start_date")
+
+
+# Each team's storage (in MB) per day, with each member's share, written by the nightly storage job. This is what we
+# show as a team's storage history, so we never have to add up Usage when someone asks
+class TeamUsage(models.Model):
+    team = models.ForeignKey(Team, on_delete=models.CASCADE)
+    date = models.DateField()
+    usage = models.IntegerField()
+    members = models.JSONField(default=dict)  # {user id: usage}
+
+    class Meta:
+        unique_together = ("team", "date")
+
+
+# Emails waiting to be sent. These are written in the same transaction as whatever they're about, and sent in the
+# background by the send_queued_emails task (see server/outbox.py)
+class OutgoingEmail(models.Model):
+    to_email = models.EmailField()
+    template_id = models.CharField(max_length=50)  # SendGrid's ID
+    template_data = models.JSONField(null=True)
+    created_date = models.DateTimeField(auto_now_add=True)
+    send_after = models.DateTimeField()  # When the next attempt is due
+    attempts = models.IntegerField(default=0)
+    sent_date = models.DateTimeField(blank=True, null=True)
+    last_error = models.TextField(blank=True, default="")
+
+    class Meta:
+        indexes = [models.Index(fields=["sent_date", "send_after"])]
+
 
 UserType = User
 
@@ -0,0 +1,158 @@
+# Works out how much disk each user's etebase media (MEDIA_ROOT/user_<id>) is using, like `du -d 1` did.
+# Users are scanned in parallel across a pool of processes, and we keep a manifest of every directory we've seen (its
+# mtime, the files directly in it and its subdirectories). A directory's mtime only changes when something is added to
+# or removed from it, and etebase never rewrites a chunk in place, so if the mtime hasn't changed we reuse what we
+# counted last time and only look at its subdirectories. Most of a user's data doesn't change between nights.
+import json
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from loguru import logger
+
+USER_DIR = re.compile(r"^user_(\d+)$")
+MANIFEST_VERSION = 1
+
+
+def disk_usage(stat):
+    # Space used on disk (not the file size), which is what du counts
+    return stat.st_blocks * 512
+
+
+def scan_user_dir(path, manifest):
+    """
+    Total bytes under path. manifest is what this returned last time for the same path, as
+    {relative dir path: [mtime_ns, bytes of files directly in it, number of those files, [subdirectory names]]}
+    Returns (bytes, new manifest, files, files_scanned, dirs_skipped)
+    """
+    new_manifest = dict()
+    usage = 0
+    files = 0
+    files_scanned = 0
+    dirs_skipped = 0
+
+    try:
+        stack = [("", os.stat(path, follow_symlinks=False))]
+    except FileNotFoundError:
+        return 0, new_manifest, 0, 0, 0
+
+    while stack:
+        rel_path, stat = stack.pop()
+        dir_path = os.path.join(path, rel_path)
+        usage += disk_usage(stat)
+
+        entry = manifest.get(rel_path)
+        if entry is not None and entry[0] == stat.st_mtime_ns:
+            # Nothing added or removed here since last time
+            _, file_usage, file_count, subdirs = entry
+            dirs_skipped += 1
+
+            for name in subdirs:
+                try:
+                    stack.append(
+                        (os.path.join(rel_path, name), os.stat(os.path.join(dir_path, name), follow_symlinks=False))
+                    )
+                except FileNotFoundError:
+                    pass
+        else:
+            file_usage = 0
+            file_count = 0
+            subdirs = []
+
+            try:
+                with os.scandir(dir_path) as it:
+                    for item in it:
+                        if item.is_dir(follow_symlinks=False):
+                            subdirs.append(item.name)
+                            stack.append((os.path.join(rel_path, item.name), item.stat(follow_symlinks=False)))
+                        else:
+                            file_usage += disk_usage(item.stat(follow_symlinks=False))
+                            file_count += 1
+            except FileNotFoundError:
+                # Deleted while we were scanning, it'll be gone next time
+                continue
+
+            files_scanned += file_count
+
+        # The mtime is from before we listed the directory, so if it changes while we scan we'll look again next time
+        new_manifest[rel_path] = [stat.st_mtime_ns, file_usage, file_count, subdirs]
+        usage += file_usage
+        files += file_count
+
+    return usage, new_manifest, files, files_scanned, dirs_skipped
+
+
+def load_manifest(manifest_path):
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if manifest.get("version") == MANIFEST_VERSION:
+            return manifest["users"]
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning(f"Ignoring storage manifest {manifest_path} - {e}")
+
+    return dict()
+
+
+def save_manifest(manifest_path, users):
+    # Write then rename, so a crash never leaves half a manifest behind
+    tmp_path = f"{manifest_path}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump({"version": MANIFEST_VERSION, "users": users}, f, separators=(",", ":"))
+    os.replace(tmp_path, manifest_path)
+
+
+def list_user_dirs(root):
+    user_dirs = dict()
+    with os.scandir(root) as it:
+        for item in it:
+            match = USER_DIR.match(item.name)
+            if match and item.is_dir(follow_symlinks=False):
+                user_dirs[int(match.group(1))] = item.path
+    return user_dirs
+
+
+def scan_storage(root, manifest_path, workers=None):
+    """Bytes used by each user, as {user_id: bytes}"""
+    start = time.monotonic()
+
+    manifest = load_manifest(manifest_path)
+    user_dirs = list_user_dirs(root)
+    user_ids = list(user_dirs.keys())
+
+    usage = dict()
+    new_manifest = dict()
+    files = files_scanned = dirs_skipped = 0
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(
+            scan_user_dir,
+            [user_dirs[user_id] for user_id in user_ids],
+            [manifest.get(str(user_id), {}) for user_id in user_ids],
+            chunksize=4,
+        )
+
+        for user_id, (user_usage, user_manifest, user_files, user_files_scanned, user_dirs_skipped) in zip(
+            user_ids, results
+        ):
+            usage[user_id] = user_usage
+            new_manifest[str(user_id)] = user_manifest
+            files += user_files
+            files_scanned += user_files_scanned
+            dirs_skipped += user_dirs_skipped
+
+    # Users that have gone are dropped from the manifest
+    save_manifest(manifest_path, new_manifest)
+
+    elapsed = max(time.monotonic() - start, 0.001)
+    total = sum(usage.values())
+    logger.info(
+        f"Scanned storage for {len(usage)} users in {elapsed:.1f}s: {files} files ({files_scanned} read, "
+        f"{dirs_skipped} unchanged directories skipped), {total} bytes. "
+        f"{files / elapsed:.0f} files/s, {total / elapsed:.0f} bytes/s"
+    )
+
+    return usage
@@ -0,0 +1,175 @@
+# Keeps the Usage history from growing forever. Daily rows older than USAGE_DAILY_RETENTION_DAYS are rolled up into a
+# row per user per week, and weeks older than USAGE_WEEKLY_RETENTION_DAYS into a row per user per month.
+# On Postgres, Usage is partitioned by month (see migration 0041), so once a month has been rolled up we drop its
+# partition rather than deleting the rows one by one
+from datetime import datetime, time, timedelta, timezone
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Count, F, Max, Sum
+from django.db.models.functions import TruncMonth, TruncWeek
+from loguru import logger
+
+from myauth.models import Usage, UsageRollup
+
+PARTITION_PREFIX = "myauth_usage_"
+
+
+def week_start(day):
+    return day - timedelta(days=day.weekday())
+
+
+def month_start(day):
+    return day.replace(day=1)
+
+
+def next_month(day):
+    return (day.replace(day=1) + timedelta(days=32)).replace(day=1)
+
+
+def to_datetime(day):
+    return datetime.combine(day, time.min, tzinfo=timezone.utc)
+
+
+def is_partitioned():
+    if connection.vendor != "postgresql":
+        return False
+
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass", [Usage._meta.db_table])
+        return cursor.fetchone() is not None
+
+
+def ensure_usage_partitions(today=None, months_ahead=None):
+    # Create this month's partition and the next few, so nightly rows never land in the default partition
+    if not is_partitioned():
+        return
+
+    month = month_start(today or datetime.now(tz=timezone.utc).date())
+    with connection.cursor() as cursor:
+        for _ in range((settings.USAGE_PARTITIONS_AHEAD if months_ahead is None else months_ahead) + 1):
+            cursor.execute(
+                f"CREATE TABLE IF NOT EXISTS {PARTITION_PREFIX}{month:%Y_%m} PARTITION OF {Usage._meta.db_table} "
+                "FOR VALUES FROM (%s) TO (%s)",
+                [to_datetime(month), to_datetime(next_month(month))],
+            )
+            month = next_month(month)
+
+
+def drop_usage_partitions(before):
+    # Drop every monthly partition that ends on or before this date, returns how many were dropped
+    if not is_partitioned():
+        return 0
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT child.relname FROM pg_inherits "
+            "JOIN pg_class parent ON pg_inherits.inhparent = parent.oid "
+            "JOIN pg_class child ON pg_inherits.inhrelid = child.oid "
+            "WHERE parent.relname = %s",
+            [Usage._meta.db_table],
+        )
+        partitions = [name for (name,) in cursor.fetchall()]
+
+        dropped = 0
+        for name in partitions:
+            try:
+                month = datetime.strptime(name[len(PARTITION_PREFIX) :], "%Y_%m").date()
+            except ValueError:
+                continue  # ie. the default partition
+
+            if next_month(month) <= before:
+                cursor.execute(f"DROP TABLE {name}")
+                dropped += 1
+
+    return dropped
+
+
+def merge_rollups(period, rows):
+    # rows are [(user_id, start_date, total usage, peak usage, samples)]. If we already have a rollup for the same
+    # user and period (eg. rows that arrived late), they're combined
+    existing = {
+        (rollup.user_id, rollup.start_date): rollup
+        for rollup in UsageRollup.objects.filter(
+            period=period,
+            user_id__in={user_id for (user_id, _, _, _, _) in rows},
+            start_date__in={start_date for (_, start_date, _, _, _) in rows},
+        )
+    }
+
+    created = []
+    updated = []
+    for (user_id, start_date, total, peak, samples) in rows:
+        rollup = existing.get((user_id, start_date))
+        if rollup is None:
+            created.append(
+                UsageRollup(
+                    user_id=user_id,
+                    period=period,
+                    start_date=start_date,
+                    usage=round(total / samples),
+                    peak_usage=peak,
+                    samples=samples,
+                )
+            )
+        else:
+            total += rollup.usage * rollup.samples
+            rollup.samples += samples
+            rollup.usage = round(total / rollup.samples)
+            rollup.peak_usage = max(rollup.peak_usage, peak)
+            updated.append(rollup)
+
+    UsageRollup.objects.bulk_create(created)
+    UsageRollup.objects.bulk_update(updated, ["usage", "peak_usage", "samples"])
+
+
+def roll_up_days(before):
+    old = Usage.objects.filter(date__lt=to_datetime(before))
+
+    with transaction.atomic():
+        rows = [
+            (row["user_id"], row["week"].date(), row["total"], row["peak"], row["samples"])
+            for row in old.annotate(week=TruncWeek("date", tzinfo=timezone.utc))
+            .values("user_id", "week")
+            .annotate(total=Sum("usage"), peak=Max("usage"), samples=Count("id"))
+            .order_by()
+        ]
+        merge_rollups("week", rows)
+        dropped = drop_usage_partitions(before)
+        old.delete()
+
+    return len(rows), dropped
+
+
+def roll_up_weeks(before):
+    old = UsageRollup.objects.filter(period="week", start_date__lt=before)
+
+    with transaction.atomic():
+        rows = [
+            (row["user_id"], row["month"], row["total"], row["peak"], row["samples"])
+            for row in old.annotate(month=TruncMonth("start_date"))
+            .values("user_id", "month")
+            .annotate(total=Sum(F("usage") * F("samples")), peak=Max("peak_usage"), samples=Sum("samples"))
+            .order_by()
+        ]
+        merge_rollups("month", rows)
+        old.delete()
+
+    return len(rows)
+
+
+def compact_usage(today=None):
+    today = today or datetime.now(tz=timezone.utc).date()
+
+    # Only whole weeks and months are rolled up
+    days_before = week_start(today - timedelta(days=settings.USAGE_DAILY_RETENTION_DAYS))
+    weeks_before = month_start(today - timedelta(days=settings.USAGE_WEEKLY_RETENTION_DAYS))
+
+    weeks, dropped = roll_up_days(days_before)
+    months = roll_up_weeks(weeks_before)
+    ensure_usage_partitions(today)
+
+    logger.info(
+        f"Compacted usage: {weeks} weekly rollups from before {days_before} ({dropped} partitions dropped), "
+        f"{months} monthly rollups from before {weeks_before}"
+    )
@@ -0,0 +1,100 @@
+# Compares serving Django through Starlette's WSGIMiddleware with serving it natively (server/handlers.py).
+# Both are driven in process over ASGI, so this measures the bridges rather than the network or uvicorn. Needs a
+# migrated database, eg.
+#
+#   DJANGO_SETTINGS_MODULE=server.settings.test python scripts/bench_django_asgi.py --requests 2000 --concurrency 32
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+import django
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "server.settings.base")
+django.setup()
+
+from django.core.wsgi import get_wsgi_application  # noqa: E402
+from starlette.middleware.wsgi import WSGIMiddleware  # noqa: E402
+
+from server.handlers import DjangoHandler  # noqa: E402
+
+# (Label, method, path, body). Paths are as Django sees them, ie. under /django
+CASES = [
+    ("GET /api/", "GET", "/api/", b""),
+    ("GET /api/tier/", "GET", "/api/tier/", b""),
+    ("POST 200KB /api/feedback/ (401)", "POST", "/api/feedback/", json.dumps({"x": "a" * 200000}).encode()),
+]
+
+
+async def call(app, method, path, body):
+    scope = {
+        "type": "http",
+        "http_version": "1.1",
+        "method": method,
+        "scheme": "http",
+        "path": path,
+        "raw_path": path.encode(),
+        "root_path": "/django",
+        "query_string": b"",
+        "headers": [(b"host", b"localhost"), (b"content-type", b"application/json")],
+        "server": ("localhost", 80),
+        "client": ("127.0.0.1", 1234),
+    }
+    received = False
+
+    async def receive():
+        nonlocal received
+        if received:
+            await asyncio.sleep(3600)  # Only a disconnect would come next
+        received = True
+        return {"type": "http.request", "body": body, "more_body": False}
+
+    status = None
+
+    async def send(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+
+    await app(scope, receive, send)
+    return status
+
+
+async def bench(app, method, path, body, requests, concurrency):
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            status = await call(app, method, path, body)
+            latencies.append(time.perf_counter() - start)
+            if status >= 500:
+                raise RuntimeError(f"{method} {path} returned {status}")
+
+    start = time.perf_counter()
+    await asyncio.gather(*[one() for _ in range(requests)])
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    p50, p99 = latencies[len(latencies) // 2], latencies[int(len(latencies) * 0.99)]
+    return f"{requests / elapsed:7.0f} req/s  p50 {p50 * 1000:6.2f}ms  p99 {p99 * 1000:6.2f}ms"
+
+
+async def main(args):
+    apps = [("wsgi", WSGIMiddleware(get_wsgi_application())), ("asgi", DjangoHandler())]
+
+    for label, method, path, body in CASES:
+        for name, app in apps:
+            await bench(app, method, path, body, args.requests // 10, args.concurrency)  # Warm up
+            print(f"{label:32} {name}: {await bench(app, method, path, body, args.requests, args.concurrency)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="WSGIMiddleware vs. native ASGI for Django")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    asyncio.get_event_loop().run_until_complete(main(parser.parse_args()))
@@ -0,0 +1,93 @@
+# Compares rendering API responses with ninja's JSONRenderer (json and DjangoJSONEncoder) and with our
+# ORJSONRenderer (server/api/renderers.py), next to the pydantic validation and .dict() ninja does first. No
+# database needed, eg.
+#
+#   DJANGO_SETTINGS_MODULE=server.settings.test python scripts/bench_renderers.py
+import os
+import sys
+import timeit
+from datetime import datetime, timezone
+
+import django
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "server.settings.base")
+django.setup()
+
+from ninja.renderers import JSONRenderer  # noqa: E402
+
+from server.api import renderers  # noqa: E402
+from server.api.schemas import CurrentLimitsOut, TeamsOut, UserProfileOut  # noqa: E402
+
+NOW = datetime.now(tz=timezone.utc)
+TIER = dict(
+    id=1,
+    name="PRO",
+    stripe_flat_price_id="price_flat",
+    stripe_storage_price_id="price_storage",
+    stripe_user_price_id="price_user",
+    stripe_collaborator_price_id="price_collaborator",
+    stripe_project_price_id="price_project",
+    base_user_limit=5,
+    base_project_limit=5,
+    base_collaborator_limit=5,
+    base_storage_limit=1000,
+    is_custom=False,
+    custom_subscription_id=None,
+)
+PROFILE = dict(
+    id=1,
+    name="Name",
+    email="user@example.com",
+    email_verified=NOW,
+    is_collaborator=False,
+    is_trusted_service=False,
+    team=dict(id=1, name="Team", owner_id=1, tier=TIER, usage=10),
+)
+INVITE = dict(email="invite@example.com", sent_date=NOW, is_collaborator=False)
+LIMITS = dict(
+    has_billing=True,
+    tier_name="PRO",
+    tier_id=1,
+    users_limit=5,
+    projects_limit=5,
+    collaborators_limit=5,
+    users=1,
+    projects=2,
+    collaborators=0,
+    storage=10,
+    storage_included_limit=1000,
+)
+
+# (Label, schema, data, calls)
+CASES = [
+    ("UserProfileOut", UserProfileOut, PROFILE, 5000),
+    (
+        "TeamsOut (50 members)",
+        TeamsOut,
+        dict(profiles=[PROFILE] * 50, pending_invites=[INVITE] * 10, owner=dict(id=1, email="user@example.com")),
+        500,
+    ),
+    ("CurrentLimitsOut", CurrentLimitsOut, LIMITS, 5000),
+]
+
+
+def per_call(fn, number):
+    return timeit.timeit(fn, number=number) / number * 1e6
+
+
+if __name__ == "__main__":
+    if renderers.orjson is None:
+        sys.exit("orjson isn't installed, so ORJSONRenderer would render with json too")
+
+    json_renderer, orjson_renderer = JSONRenderer(), renderers.ORJSONRenderer()
+    print(f"orjson {renderers.orjson.__version__}")
+    for label, schema, data, number in CASES:
+        rendered = schema(**data).dict()
+        validate = per_call(lambda: schema(**data).dict(), number)
+        before = per_call(lambda: json_renderer.render(None, rendered, response_status=200), number)
+        after = per_call(lambda: orjson_renderer.render(None, rendered, response_status=200), number)
+        print(
+            f"{label:24} validate+.dict() {validate:8.1f}us  JSONRenderer {before:7.1f}us  "
+            f"ORJSONRenderer {after:6.1f}us  ({before / after:.1f}x)"
+        )
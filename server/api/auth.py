@@ -0,0 +1,109 @@
+import copy
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django_etebase.token_auth.models import AuthToken
+from etebase_fastapi.dependencies import get_authenticated_user
+from loguru import logger
+
+from myauth.models import User, UserProfile
+from server.cache import TTLCache
+
+# Etebase token -> User. Every authenticated request resolves its token, so we keep these for a short while
+# rather than asking the DB each time. Entries are dropped when the token is deleted (logout/expiry) or the
+# user changes (eg. they are disabled)
+token_cache = TTLCache("auth", max_size=settings.AUTH_CACHE_MAX_SIZE, ttl=settings.AUTH_CACHE_TTL)
+
+
+def get_token_from_key(key):
+    # The header is "Token <token>"
+    return key.split()[-1]
+
+
+def detach(user):
+    # Hand out a copy without any related objects (userprofile, team...) cached on it, so requests
+    # never share (or mutate) each other's related instances
+    user = copy.copy(user)
+    user._state = copy.copy(user._state)
+    user._state.fields_cache = {}
+    return user
+
+
+def get_cached_user(key):
+    """Same as etebase's get_authenticated_user (and raises the same way), but cached per token"""
+    token = get_token_from_key(key)
+
+    user = token_cache.get(token)
+    if user is None:
+        user = get_authenticated_user(key)  # Validate with Etebase
+        token_cache.set(token, detach(user))
+
+    return detach(user)
+
+
+class RequestAuth:
+    """
+    The authenticated user for a single request. ResolveAuthMiddleware creates one of these per request and
+    the middlewares/API all share it, so the token is only looked up once (and only if something needs it)
+    """
+
+    def __init__(self, key):
+        self.key = key
+        self.resolved = False
+        self.user = None
+        self.profile = None
+        self.team = None
+
+    def resolve(self):
+        if self.resolved:
+            return self
+
+        self.resolved = True
+        try:
+            user = get_cached_user(self.key)
+        except Exception as e:
+            # Leave it to the regular auth to reject the request
+            logger.warning(f"Received Exception {e}")
+            return self
+
+        self.user = user
+        try:
+            # With the team's tier and owner, which the API needs (GET /team sends the owner)
+            self.profile = UserProfile.objects.select_related("team__tier", "team__owner").get(user_id=user.id)
+            self.team = self.profile.team
+            user.userprofile = self.profile
+        except UserProfile.DoesNotExist:
+            # They have an etebase account but haven't created a profile yet
+            pass
+
+        return self
+
+
+# Also set by ResolveAuthMiddleware, so code that can't see the ASGI scope (ie. Django, which runs on a thread in a
+# copy of this context, see server/handlers.py) can still find the request's auth
+current_request_auth: ContextVar = ContextVar("current_request_auth", default=None)
+
+
+def get_request_auth(key):
+    auth = current_request_auth.get()
+    if auth is not None and auth.key == key:
+        return auth.resolve()
+
+    return RequestAuth(key).resolve()
+
+
+def invalidate_user(user_id):
+    token_cache.delete_where(lambda token, user: user.id == user_id)
+
+
+@receiver(post_delete, sender=AuthToken)
+def invalidate_deleted_token(sender, instance, **kwargs):
+    token_cache.delete(instance.key)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_changed_user(sender, instance, **kwargs):
+    invalidate_user(instance.id)
@@ -1,6 +1,8 @@
+from concurrent.futures import ThreadPoolExecutor, wait
 from datetime import datetime, timezone
 from django.conf import settings
-from django.db.models import Sum
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Subquery, Sum
 from django_etebase.models import Collection
 from loguru import logger
 from ninja import Router
@@ -8,7 +10,21 @@ import stripe
 import ipaddress
 
 
-from myauth.models import Tier, Team, Billing, TierAddons, User, UserProfile, CustomBilling, Invite
+from myauth.counters import rebuild_team_counters
+from myauth.models import (
+    Tier,
+    Team,
+    Billing,
+    BillingItem,
+    StripePrice,
+    TierAddons,
+    User,
+    UserProfile,
+    CustomBilling,
+    Invite,
+    TeamCounters,
+)
+from server.cache import TTLCache
 from server.api.schemas import (
     CheckoutSessionIn,
     CheckoutSessionOut,
@@ -25,10 +41,174 @@ from server.api.schemas import (
 )
 
 stripe.api_key = settings.STRIPE_SECRET_KEY
+# The default is 80s, which is far longer than anyone will wait for a page
+stripe.default_http_client = stripe.http_client.new_default_http_client(timeout=settings.STRIPE_TIMEOUT)
 endpoint_secret = settings.STRIPE_WEBHOOK_SECRET
 
 router = Router()
 
+# Stripe objects we read on most billing page views. Prices hardly ever change, and the webhook tells us when they (or
+# a subscription) do, so we only go back to Stripe when these expire or are invalidated
+price_cache = TTLCache("stripe_prices", max_size=settings.STRIPE_CACHE_MAX_SIZE, ttl=settings.STRIPE_PRICE_CACHE_TTL)
+subscription_cache = TTLCache(
+    "stripe_subscriptions", max_size=settings.STRIPE_CACHE_MAX_SIZE, ttl=settings.STRIPE_SUBSCRIPTION_CACHE_TTL
+)
+
+
+# Shared by every request, so however many prices we need at once we don't make more than this many calls at a time
+stripe_pool = ThreadPoolExecutor(max_workers=settings.STRIPE_MAX_CONCURRENCY, thread_name_prefix="stripe")
+
+
+def fetch_stripe_price(price_id):
+    price = stripe.Price.retrieve(price_id, expand=["tiers"])
+    price_cache.set(price_id, price)
+    return price
+
+
+def get_stripe_price(price_id):
+    price = price_cache.get(price_id)
+    if price is None:
+        price = fetch_stripe_price(price_id)
+    return price
+
+
+def get_stripe_prices(price_ids):
+    """
+    Gets several prices at once, fetching any we don't have concurrently. Any that fail (or take too long) are
+    logged and left out, so callers should expect some to be missing
+    """
+    prices = dict()
+    fetching = dict()
+
+    for price_id in set(price_ids):
+        price = price_cache.get(price_id)
+        if price is not None:
+            prices[price_id] = price
+        else:
+            fetching[stripe_pool.submit(fetch_stripe_price, price_id)] = price_id
+
+    if not fetching:
+        return prices
+
+    done, not_done = wait(fetching, timeout=settings.STRIPE_TIMEOUT)
+
+    for future in done:
+        try:
+            prices[fetching[future]] = future.result()
+        except Exception as e:
+            logger.error(f"Error getting Stripe price {fetching[future]} - {e}")
+
+    for future in not_done:
+        logger.error(f"Timed out getting Stripe price {fetching[future]}")
+
+    return prices
+
+
+def get_stripe_subscription(subscription_id):
+    subscription = subscription_cache.get(subscription_id)
+    if subscription is None:
+        subscription = stripe.Subscription.retrieve(subscription_id)
+        subscription_cache.set(subscription_id, subscription)
+    return subscription
+
+
+def get_stripe_subscription_items(subscription_id):
+    items = subscription_cache.get(("items", subscription_id))
+    if items is None:
+        items = stripe.SubscriptionItem.list(subscription=subscription_id, expand=["data.price.tiers"])
+        subscription_cache.set(("items", subscription_id), items)
+    return items
+
+
+# Call this whenever we change a subscription
+def invalidate_stripe_subscription(subscription_id):
+    subscription_cache.delete(subscription_id)
+    subscription_cache.delete(("items", subscription_id))
+
+
+def from_stripe_timestamp(timestamp):
+    return datetime.fromtimestamp(timestamp, timezone.utc) if timestamp else None
+
+
+def to_stripe_timestamp(date):
+    return int(date.timestamp()) if date else None
+
+
+# We keep our own copy of each team's subscription (Billing + BillingItem) and the prices it uses (StripePrice),
+# so showing a plan doesn't need Stripe. The webhook keeps these up to date, as do we when we change a subscription
+def mirror_price(price):
+    tiers = price.get("tiers")
+
+    # Tiers aren't included unless they're expanded, which they aren't in webhook events
+    if price.get("billing_scheme") == "tiered" and tiers is None:
+        price = stripe.Price.retrieve(price["id"], expand=["tiers"])
+        tiers = price["tiers"]
+
+    return StripePrice.objects.update_or_create(
+        id=price["id"],
+        defaults=dict(
+            unit_amount=price.get("unit_amount"),
+            tiers=[dict(up_to=tier["up_to"], unit_amount=tier["unit_amount"]) for tier in tiers] if tiers else None,
+        ),
+    )[0]
+
+
+# Like get_stripe_prices, some may be missing if we didn't have them and Stripe failed
+def get_mirrored_prices(price_ids):
+    prices = StripePrice.objects.in_bulk(price_ids)
+
+    for price in get_stripe_prices(set(price_ids) - prices.keys()).values():
+        prices[price["id"]] = mirror_price(price)
+
+    return prices
+
+
+def sync_subscription(billing: Billing, subscription, as_of=None):
+    # Events can arrive out of order, don't overwrite anything newer than them
+    if as_of is not None and billing.synced_date is not None and as_of < billing.synced_date:
+        return
+
+    items = subscription["items"]["data"]
+
+    with transaction.atomic():
+        billing.start_date = from_stripe_timestamp(subscription["current_period_start"])
+        billing.renewal_date = from_stripe_timestamp(subscription["current_period_end"])
+        billing.trial_start = from_stripe_timestamp(subscription["trial_start"])
+        billing.trial_end = from_stripe_timestamp(subscription["trial_end"])
+        billing.cancel_date = from_stripe_timestamp(subscription["canceled_at"])
+        billing.synced_date = as_of or datetime.now(tz=timezone.utc)
+        billing.save()
+
+        BillingItem.objects.filter(billing=billing).delete()
+        BillingItem.objects.bulk_create(
+            [
+                BillingItem(
+                    billing=billing,
+                    stripe_item_id=item["id"],
+                    stripe_price_id=item["price"]["id"],
+                    quantity=item.get("quantity"),
+                )
+                for item in items
+            ]
+        )
+
+        # Price changes come through their own events, so only add ones we haven't seen
+        prices = {item["price"]["id"]: item["price"] for item in items}
+        known_price_ids = StripePrice.objects.in_bulk(list(prices.keys())).keys()
+        for price_id, price in prices.items():
+            if price_id not in known_price_ids:
+                mirror_price(price)
+
+
+def sync_billing(billing: Billing):
+    # Copy a subscription we haven't got yet (teams from before we kept one) from Stripe. False if Stripe failed
+    try:
+        sync_subscription(billing, stripe.Subscription.retrieve(billing.subscription_id))
+        return True
+    except Exception as e:
+        logger.error(f"Error syncing stripe subscription for team {billing.team_id} - {e}")
+        return False
+
 
 # Filter a stripe subscription to get the IDs of prices already applied (so we can update them)
 def get_user_price_id(price_id, subscription):
@@ -105,6 +285,7 @@ def create_stripe_subscription(email, name, user_id: int, team_id: int, tier: Ti
             team_id=team_id,
             subscription_id=subscription["id"],
         )
+        sync_subscription(billing, subscription)
 
         return subscription, billing
     except Exception as e:
@@ -126,60 +307,78 @@ def calculate_plan(team: Team):
     if not hasattr(team, "billing"):
         logger.info(f"Migrating {team.id} to billing 2.0")
 
-        create_stripe_subscription(
+        migrated = create_stripe_subscription(
             team.owner.email, team.owner.userprofile.name, team.owner.id, team.id, team.tier, "127.0.0.1", False
         )
+        if migrated is None:
+            # We couldn't reach Stripe (it's logged), we'll try again next time
+            return None
 
-    subscription = stripe.Subscription.retrieve(team.billing.subscription_id)
-
-    plan["current_period_end"] = subscription.current_period_end
-    plan["current_period_start"] = subscription.current_period_start
-    plan["trial_end"] = subscription.trial_end
-    plan["trial_start"] = subscription.trial_start
+        _, billing = migrated
+    else:
+        billing = team.billing
 
-    items = stripe.SubscriptionItem.list(subscription=team.billing.subscription_id, expand=["data.price.tiers"])
+    # We haven't got a copy of their subscription yet (they signed up before we kept one, see sync_billing)
+    if billing.synced_date is None and not sync_billing(billing):
+        return None
 
-    storage = [item for item in items if item.price["id"] == team.tier.stripe_storage_price_id]
-    project = [item for item in items if item.price["id"] == team.tier.stripe_project_price_id]
-    base = [item for item in items if item.price["id"] == team.tier.stripe_flat_price_id]
-    user = [item for item in items if item.price["id"] == team.tier.stripe_user_price_id]
-    collaborator = [item for item in items if item.price["id"] == team.tier.stripe_collaborator_price_id]
+    plan["current_period_end"] = to_stripe_timestamp(billing.renewal_date)
+    plan["current_period_start"] = to_stripe_timestamp(billing.start_date)
+    plan["trial_end"] = to_stripe_timestamp(billing.trial_end)
+    plan["trial_start"] = to_stripe_timestamp(billing.trial_start)
+
+    items = list(BillingItem.objects.filter(billing=billing))
+    prices = get_mirrored_prices([item.stripe_price_id for item in items])
+
+    def find(price_id):
+        # get_mirrored_prices leaves out any price it couldn't get, which we treat as not being on the plan
+        item = next((item for item in items if item.stripe_price_id == price_id), None)
+        price = prices.get(price_id)
+        if item is None or price is None:
+            if item is not None:
+                logger.warning(f"No price {price_id} for team {team.id}, leaving it out of their plan")
+            return None, None
+        return item, price
+
+    storage, storage_price = find(team.tier.stripe_storage_price_id)
+    project, project_price = find(team.tier.stripe_project_price_id)
+    base, base_price = find(team.tier.stripe_flat_price_id)
+    user, user_price = find(team.tier.stripe_user_price_id)
+    collaborator, collaborator_price = find(team.tier.stripe_collaborator_price_id)
 
     plan["addons"] = dict()
 
-    if len(base):
-        plan["base_price"] = base[0].price["unit_amount"] if base[0].price["unit_amount"] is not None else 0
+    if base:
+        plan["base_price"] = base_price.unit_amount if base_price.unit_amount is not None else 0
     else:
         plan["base_price"] = 0
 
     # No addons on free or custom plans
     if team.tier.id != 1 and not team.tier.is_custom:
-        if len(project):
+        if project:
             # this assumes tiers[0] is the included amount and tiers[1] is the ONLY charged graduation in Stripe
             # (this is for all addons)
-            price_per_unit = project[0].price.tiers[1].unit_amount
-            plan["addons"]["project"] = dict(
-                quantity=project[0]["quantity"], name="Projects", price_per_unit=price_per_unit
-            )
+            price_per_unit = project_price.tiers[1]["unit_amount"]
+            plan["addons"]["project"] = dict(quantity=project.quantity, name="Projects", price_per_unit=price_per_unit)
 
-        if len(user):
-            price_per_unit = user[0].price.tiers[1].unit_amount
-            plan["addons"]["user"] = dict(quantity=user[0]["quantity"], name="Users", price_per_unit=price_per_unit)
+        if user:
+            price_per_unit = user_price.tiers[1]["unit_amount"]
+            plan["addons"]["user"] = dict(quantity=user.quantity, name="Users", price_per_unit=price_per_unit)
 
-        if len(collaborator):
-            price_per_unit = collaborator[0].price.tiers[1].unit_amount
+        if collaborator:
+            price_per_unit = collaborator_price.tiers[1]["unit_amount"]
             plan["addons"]["collaborator"] = dict(
-                quantity=collaborator[0]["quantity"], name="Collaborator", price_per_unit=price_per_unit
+                quantity=collaborator.quantity, name="Collaborator", price_per_unit=price_per_unit
             )
 
-    if len(storage):
-        billed_usage = int(team.usage or 0) - (stripe_to_gliff_usage(storage[0].price.tiers[0].up_to))
+    if storage:
+        billed_usage = int(team.usage or 0) - (stripe_to_gliff_usage(storage_price.tiers[0]["up_to"]))
         if billed_usage >= 0:
             plan["billed_usage"] = billed_usage
         else:
             plan["billed_usage"] = 0
 
-        plan["billed_usage_gb_price"] = storage[0].price.tiers[1].unit_amount
+        plan["billed_usage_gb_price"] = storage_price.tiers[1]["unit_amount"]
 
     else:
         plan["billed_usage"] = 0
@@ -192,75 +391,87 @@ def calculate_plan(team: Team):
     else:
         plan["is_trial"] = False
 
-    if team.billing.cancel_date:
-        plan["cancel_date"] = datetime.timestamp(team.billing.cancel_date)
+    if billing.cancel_date:
+        plan["cancel_date"] = datetime.timestamp(billing.cancel_date)
 
     return plan
 
 
-def calculate_limits(team):
-    team_members = UserProfile.objects.filter(team__owner_id=team.owner).values_list("user_id", flat=True)
-    users = (
-        User.objects.filter(
-            userprofile__team__owner_id=team.owner,
-            userprofile__is_collaborator=False,
-            userprofile__is_trusted_service=False,
-        ).count()
-        + Invite.objects.filter(
-            from_team__owner_id=team.owner, is_collaborator=False, accepted_date__isnull=True
-        ).count()
-    )
+# Limit -> (TeamCounters that count towards it, TierAddons field, Tier field)
+LIMITS = {
+    "users": (["users", "pending_user_invites"], "additional_user_count", "base_user_limit"),
+    "projects": (["projects"], "additional_project_count", "base_project_limit"),
+    "collaborators": (
+        ["collaborators", "pending_collaborator_invites"],
+        "additional_collaborator_count",
+        "base_collaborator_limit",
+    ),
+}
 
-    collaborators = (
-        User.objects.filter(
-            userprofile__team__owner_id=team.owner,
-            userprofile__is_collaborator=True,
-            userprofile__is_trusted_service=False,
-        ).count()
-        + Invite.objects.filter(
-            from_team__owner_id=team.owner, is_collaborator=True, accepted_date__isnull=True
-        ).count()
-    )
 
-    storage = Team.objects.filter(id=team.id).values("usage")[0]
-    projects = Collection.objects.filter(owner__in=team_members).count()
+def addons_total(field):
+    totals = TierAddons.objects.filter(team=OuterRef("team")).order_by().values("team").annotate(total=Sum(field))
+    return Subquery(totals.values("total")[:1])
 
-    plan = dict(
-        tier_name=team.tier.name,
-        tier_id=team.tier.id,
-        users=users,
-        storage=storage["usage"],
-        collaborators=collaborators,
-        projects=projects,
+
+def limits_query(team_id, limits):
+    return (
+        TeamCounters.objects.filter(team_id=team_id)
+        .annotate(
+            has_billing=Exists(Billing.objects.filter(team=OuterRef("team"))),
+            has_custom_billing=Exists(CustomBilling.objects.filter(team=OuterRef("team"))),
+            **{f"additional_{limit}": addons_total(LIMITS[limit][1]) for limit in limits},
+        )
+        .values(
+            "has_billing",
+            "has_custom_billing",
+            *[counter for limit in limits for counter in LIMITS[limit][0]],
+            *[f"additional_{limit}" for limit in limits],
+        )
     )
 
-    plan["storage_included_limit"] = team.tier.base_storage_limit
 
-    # Add limits
-    if not hasattr(team, "billing") and not hasattr(team, "custombilling"):
-        # Team is on the free plan so it's whatever those limits are
-        plan["has_billing"] = False
-        plan["projects_limit"] = team.tier.base_project_limit
-        plan["users_limit"] = team.tier.base_user_limit
-        plan["collaborators_limit"] = team.tier.base_collaborator_limit
-        return plan
+def query_limits(team, limits):
+    return limits_query(team.id, limits).first()
 
-    plan["has_billing"] = True
 
-    addons = TierAddons.objects.filter(team=team).aggregate(
-        users=Sum("additional_user_count"),
-        projects=Sum("additional_project_count"),
-        collaborators=Sum("additional_collaborator_count"),
-    )
+def add_limits(plan, row, tier, limits):
+    # row is from limits_query. Adds each limit, and how much of it is used, to plan
+    for limit in limits:
+        counters, _, tier_field = LIMITS[limit]
 
-    # None is "unlimited"
-    plan["projects_limit"] = calculate_plan_total(team.tier.base_project_limit, addons["projects"])
-    plan["users_limit"] = calculate_plan_total(team.tier.base_user_limit, addons["users"])
-    plan["collaborators_limit"] = calculate_plan_total(team.tier.base_collaborator_limit, addons["collaborators"])
+        # Pending invites count towards the limits too
+        plan[limit] = sum(row[counter] for counter in counters)
+
+        # None is "unlimited"
+        if plan["has_billing"]:
+            plan[f"{limit}_limit"] = calculate_plan_total(getattr(tier, tier_field), row[f"additional_{limit}"])
+        else:
+            plan[f"{limit}_limit"] = getattr(tier, tier_field)
 
     return plan
 
 
+# Everything is worked out in a single query. Pass `limits` (eg. ["projects"]) to only work out some of them
+def calculate_limits(team, limits=LIMITS.keys()):
+    row = query_limits(team, limits)
+    if row is None:
+        # Teams get their counters the first time we need them
+        rebuild_team_counters([team.id])
+        row = query_limits(team, limits)
+
+    plan = dict(
+        tier_name=team.tier.name,
+        tier_id=team.tier.id,
+        storage=team.usage,
+        storage_included_limit=team.tier.base_storage_limit,
+        # If not, the team is on the free plan so it's whatever those limits are
+        has_billing=row["has_billing"] or row["has_custom_billing"],
+    )
+
+    return add_limits(plan, row, team.tier, limits)
+
+
 @router.get(
     "/payment-method",
     response={200: PaymentOut, 204: None, 403: Error, 422: Error, 500: Error},
@@ -339,7 +550,7 @@ def update_current_plan(request, payload: UpdatePlanIn):
     if team.tier.is_custom:
         return 422, {"message": "You can't change to a custom plan, contact us"}
 
-    subscription = stripe.Subscription.retrieve(team.billing.subscription_id)
+    subscription = get_stripe_subscription(team.billing.subscription_id)
     stripe_customer = stripe.Customer.retrieve(team.billing.stripe_customer_id)
 
     has_payment = subscription.default_payment_method or stripe_customer.invoice_settings.default_payment_method
@@ -366,7 +577,7 @@ def update_current_plan(request, payload: UpdatePlanIn):
     if not has_payment and limits["storage"] > limits["storage_included_limit"]:
         return 422, {"message": "Storage exceeds included amount, and not payment method registered"}
 
-    items = stripe.SubscriptionItem.list(subscription=team.billing.subscription_id, expand=["data.price.tiers"])
+    items = get_stripe_subscription_items(team.billing.subscription_id)
 
     # Get the current Stripe price Ids so we can update them
     storage_id = next((item["id"] for item in items if item.price["id"] == current_tier.stripe_storage_price_id), None)
@@ -392,13 +603,18 @@ def update_current_plan(request, payload: UpdatePlanIn):
     if collaborator_id:
         items.append({"id": collaborator_id, "deleted": True})
 
-    stripe.Subscription.modify(team.billing.subscription_id, items=items)
+    subscription = stripe.Subscription.modify(team.billing.subscription_id, items=items)
+    invalidate_stripe_subscription(team.billing.subscription_id)
+    sync_subscription(team.billing, subscription)
 
     team.tier = new_tier
 
     team.save()
 
-    return calculate_plan(team)
+    plan = calculate_plan(team)
+    if plan is None:
+        return 500, {"message": "Your plan was changed, but we couldn't get its details, please try again later"}
+    return plan
 
 
 @router.get(
@@ -412,7 +628,11 @@ def get_current_plan(request):
     if user.team.owner_id != user.id:
         return 403, {"message": "Only owners can view plan details"}
 
-    return calculate_plan(team)
+    plan = calculate_plan(team)
+    if plan is None:
+        return 500, {"message": "Couldn't get plan details, please try again later"}
+
+    return plan
 
 
 @router.get(
@@ -428,21 +648,30 @@ def get_all_plans(request):
         return 403, {"message": "Only owners can view plan details"}
 
     limits = calculate_limits(team)
+
+    # Check they haven't exceeded limits for downgrading
+    tiers = [
+        tier
+        for tier in tiers
+        if tier.id != team.tier_id
+        and (tier.base_user_limit is None or limits["users"] <= tier.base_user_limit)
+        and (tier.base_project_limit is None or limits["projects"] <= tier.base_project_limit)
+        and (tier.base_collaborator_limit is None or limits["collaborators"] <= tier.base_collaborator_limit)
+    ]
+
+    # All at once, rather than one tier at a time
+    stripe_prices = get_mirrored_prices([tier.stripe_flat_price_id for tier in tiers if tier.stripe_flat_price_id])
     prices = list()
 
     for tier in tiers:
-        # Check they haven't exceeded limits for downgrading
-        if (
-            tier.id != team.tier_id
-            and (tier.base_user_limit is None or limits["users"] <= tier.base_user_limit)
-            and (tier.base_project_limit is None or limits["projects"] <= tier.base_project_limit)
-            and (tier.base_collaborator_limit is None or limits["collaborators"] <= tier.base_collaborator_limit)
-        ):
-            if tier.stripe_flat_price_id:
-                price = stripe.Price.retrieve(tier.stripe_flat_price_id, expand=["tiers"])
-                prices.append({"id": tier.id, "name": tier.name, "price": price.unit_amount})
-            else:
-                prices.append({"id": tier.id, "name": tier.name, "price": 0})
+        if tier.stripe_flat_price_id:
+            price = stripe_prices.get(tier.stripe_flat_price_id)
+            if price is None:
+                # Better to show the plans we could get than none at all
+                continue
+            prices.append({"id": tier.id, "name": tier.name, "price": price.unit_amount})
+        else:
+            prices.append({"id": tier.id, "name": tier.name, "price": 0})
 
     return {"tiers": prices}
 
@@ -461,17 +690,18 @@ def addonPrice(request):
     if not hasattr(team, "billing"):
         return 422, {"message": "No valid subscription to upgrade. Try changing your plan"}
 
-    prices = dict(project=None, user=None, collaborator=None)
-    if team.tier.stripe_project_price_id:
-        project = stripe.Price.retrieve(team.tier.stripe_project_price_id, expand=["tiers"])
-        prices["project"] = project.tiers[1].unit_amount
-    if team.tier.stripe_user_price_id:
-        user = stripe.Price.retrieve(team.tier.stripe_user_price_id, expand=["tiers"])
-        prices["user"] = user.tiers[1].unit_amount
+    price_ids = dict(
+        project=team.tier.stripe_project_price_id,
+        user=team.tier.stripe_user_price_id,
+        collaborator=team.tier.stripe_collaborator_price_id,
+    )
+    stripe_prices = get_mirrored_prices([price_id for price_id in price_ids.values() if price_id])
 
-    if team.tier.stripe_collaborator_price_id:
-        collaborator = stripe.Price.retrieve(team.tier.stripe_collaborator_price_id, expand=["tiers"])
-        prices["collaborator"] = collaborator.tiers[1].unit_amount
+    # Left as None if the tier doesn't have it (or we couldn't get it from Stripe)
+    prices = dict(project=None, user=None, collaborator=None)
+    for addon, price_id in price_ids.items():
+        if price_id in stripe_prices:
+            prices[addon] = stripe_prices[price_id].tiers[1]["unit_amount"]
 
     return prices
 
@@ -492,12 +722,13 @@ def cancel(request):
             return 422, {"message": "No valid subscription to cancel. Try changing your plan"}
 
         res = stripe.Subscription.delete(team.billing.subscription_id)
+        invalidate_stripe_subscription(team.billing.subscription_id)
 
         if res.status != "canceled":
             return 500, {"message": "There was an error cancelling, contact us at contact@gliff.ai"}
 
-        team.billing.cancel_date = datetime.fromtimestamp(res.canceled_at, timezone.utc)
-        team.billing.save()
+        # This sets the cancel date
+        sync_subscription(team.billing, res)
 
         return 200
 
@@ -529,7 +760,7 @@ def addon(request, payload: AddonIn):
             collaborators=Sum("additional_collaborator_count"),
         )
 
-        subscription = stripe.Subscription.retrieve(team.billing.subscription_id)
+        subscription = get_stripe_subscription(team.billing.subscription_id)
 
         methods = stripe.Customer.list_payment_methods(team.billing.stripe_customer_id, type="card")
 
@@ -568,7 +799,9 @@ def addon(request, payload: AddonIn):
             )
 
         # Update Stripe
-        stripe.Subscription.modify(team.billing.subscription_id, items=items)
+        subscription = stripe.Subscription.modify(team.billing.subscription_id, items=items)
+        invalidate_stripe_subscription(team.billing.subscription_id)
+        sync_subscription(team.billing, subscription)
 
         # Update DB
         addons_row = TierAddons.objects.create(
@@ -657,13 +890,44 @@ def stripe_webhook(request):
         # Fulfill the purchase...
         complete_payment_registration(session)
 
-    # if event["type"] == "":
-    # TODO Handle invoice payments to update expiry date
-    # TODO Handle cancellation hook?
+    # Something changed in Stripe (possibly from the dashboard), so update our copy
+    if event["type"] in ("price.created", "price.updated"):
+        price = event["data"]["object"]
+        price_cache.delete(price["id"])
+        mirror_price(price)
+
+    if event["type"] == "price.deleted":
+        price_cache.delete(event["data"]["object"]["id"])
+        StripePrice.objects.filter(id=event["data"]["object"]["id"]).delete()
+
+    # This includes cancellations, and renewals (which move the current period on)
+    if event["type"] in (
+        "customer.subscription.created",
+        "customer.subscription.updated",
+        "customer.subscription.deleted",
+    ):
+        subscription = event["data"]["object"]
+        invalidate_stripe_subscription(subscription["id"])
+        update_mirrored_subscription(subscription, from_stripe_timestamp(event["created"]))
+
+    # Paying an invoice can change the subscription's period (or end a trial) so fetch it again
+    if event["type"] == "invoice.paid" and event["data"]["object"].get("subscription"):
+        subscription = stripe.Subscription.retrieve(event["data"]["object"]["subscription"])
+        invalidate_stripe_subscription(subscription["id"])
+        update_mirrored_subscription(subscription)
 
     return 200
 
 
+def update_mirrored_subscription(subscription, as_of=None):
+    billing = Billing.objects.filter(subscription_id=subscription["id"]).first()
+    if billing is None:
+        logger.warning(f"Received an event for subscription {subscription['id']} which isn't ours")
+        return
+
+    sync_subscription(billing, subscription, as_of)
+
+
 # We've got a new payment method, make it the default for the customer
 def complete_payment_registration(session):
     try:
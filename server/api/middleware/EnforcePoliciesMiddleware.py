@@ -0,0 +1,63 @@
+from loguru import logger
+from starlette.responses import JSONResponse
+from starlette.types import ASGIApp, Scope, Receive, Send
+
+from .helpers import get_request_auth, get_profile, get_team_limits
+from .policies import route_policies
+
+LIMIT_MESSAGES = {
+    "projects": "Can't create a new project, limit is reached",
+    "users": "Can't invite a new user, limit is reached",
+    "collaborators": "Can't invite a new collaborator, limit is reached",
+}
+
+
+class EnforcePoliciesMiddleware:
+    """Blocks collaborators from routes they can't use, and stops teams going over their plan limits"""
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        # Allow CORS requests
+        if scope["type"] != "http" or scope["method"] == "OPTIONS":
+            await self.app(scope, receive, send)
+            return
+
+        policy = route_policies.match(scope["method"], scope["path"])
+
+        # Do we care about this route?
+        if policy is None or policy.allow:
+            await self.app(scope, receive, send)
+            return
+
+        # This runs before our regular auth, so we have to check here
+        auth = get_request_auth(scope)
+        profile = await get_profile(scope, auth) if auth is not None else None
+
+        if policy.block_collaborators:
+            if auth is None:
+                logger.error("Blocked by EnforcePoliciesMiddleware (No key)")
+                response = JSONResponse({"message": "Collaborators can't access this"}, status_code=401)
+                await response(scope, receive, send)
+                return
+
+            if profile is not None and profile.is_collaborator:
+                logger.info("Blocked by EnforcePoliciesMiddleware")
+                response = JSONResponse({"message": "Collaborators can't access this"}, status_code=401)
+                await response(scope, receive, send)
+                return
+
+        # No profile (so no team) yet, the regular auth will deal with them
+        if policy.limit is not None and profile is not None:
+            team_limits = await get_team_limits(scope, profile, policy.limit)
+
+            limit = team_limits[f"{policy.limit}_limit"]
+            if limit is not None and team_limits[policy.limit] >= limit:
+                message = LIMIT_MESSAGES[policy.limit]
+                logger.info(message)
+                response = JSONResponse({"message": message}, status_code=401)
+                await response(scope, receive, send)
+                return
+
+        await self.app(scope, receive, send)
@@ -0,0 +1,26 @@
+# Sits in front of everything else so the token in the authorization header is parsed (and, when something
+# asks for it, looked up) once per request. The enforcement middlewares and the Django API all read it from here
+from starlette.types import ASGIApp, Scope, Receive, Send
+
+from server.api.auth import RequestAuth, current_request_auth
+from .helpers import get_key_from_headers
+
+
+class ResolveAuthMiddleware:
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        key = get_key_from_headers(scope["headers"])
+        auth = RequestAuth(key) if key is not None else None
+
+        scope.setdefault("state", {})["auth"] = auth
+        token = current_request_auth.set(auth)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            current_request_auth.reset(token)
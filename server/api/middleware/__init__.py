@@ -1,2 +1,2 @@
-from .EnforceCollabMiddleware import EnforceCollabMiddleware
-from .EnforcePlanLimitsMiddleware import EnforcePlanLimitsMiddleware
+from .EnforcePoliciesMiddleware import EnforcePoliciesMiddleware
+from .ResolveAuthMiddleware import ResolveAuthMiddleware
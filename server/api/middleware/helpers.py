@@ -1,18 +1,101 @@
-from etebase_fastapi.dependencies import get_authenticated_user
-from asgiref.sync import sync_to_async
-from server.api.billing import calculate_limits
+from datetime import datetime, timezone
 
+from django.db.models import Q
+from django_etebase.token_auth.models import AuthToken
+from loguru import logger
 
-@sync_to_async()
-def get_user_is_collab(key):
-    user = get_authenticated_user(key)
-    return user.userprofile.is_collaborator
+from myauth.models import Team, Tier, UserProfile
+from server import asyncdb
+from server.api.auth import get_token_from_key
+from server.api.billing import LIMITS, add_limits, calculate_limits, limits_query
+from server.bulkheads import get_bulkhead
 
+PROFILE_FIELDS = ["is_collaborator", "team_id"]
+TEAM_FIELDS = ["usage", "tier_id"]
+TIER_FIELDS = ["name", "base_user_limit", "base_project_limit", "base_collaborator_limit", "base_storage_limit"]
 
-@sync_to_async()
-def get_team_limits(key):
-    user = get_authenticated_user(key)
-    return calculate_limits(user.userprofile.team)
+
+async def resolve_auth(scope, auth):
+    # Only pay for the thread hop the first time something on this request needs the user. These run on the pool
+    # for the route being requested, so they can't hold up other kinds of request
+    if not auth.resolved:
+        await get_bulkhead(scope["path"]).run(auth.resolve)
+    return auth
+
+
+def profile_query(token, now):
+    # The token's user's profile, team and tier in one go, but only if etebase would accept the token
+    # (see etebase's get_authenticated_user)
+    return AuthToken.objects.filter(
+        Q(expiry__isnull=True) | Q(expiry__gt=now),
+        key=token,
+        user__is_active=True,
+        user__userprofile__isnull=False,
+    ).values(
+        *[f"user__userprofile__{field}" for field in PROFILE_FIELDS],
+        *[f"user__userprofile__team__{field}" for field in TEAM_FIELDS],
+        *[f"user__userprofile__team__tier__{field}" for field in TIER_FIELDS],
+    )[
+        :1
+    ]
+
+
+# Building and compiling these took longer than running them, so it's done once. The placeholders can't be real
+# tokens or team ids
+PROFILE_QUERY = asyncdb.PreparedQuery(profile_query, "<token>", datetime(1970, 1, 1, tzinfo=timezone.utc))
+LIMITS_QUERIES = {
+    limit: asyncdb.PreparedQuery(lambda team_id, limit=limit: limits_query(team_id, [limit])[:1], -1)
+    for limit in LIMITS
+}
+
+
+async def fetch_profile(key):
+    rows = await asyncdb.pool.fetch(PROFILE_QUERY, get_token_from_key(key), datetime.now(tz=timezone.utc))
+    if not rows:
+        return None
+
+    row = rows[0]
+    tier = Tier(**{field: row[f"user__userprofile__team__tier__{field}"] for field in TIER_FIELDS})
+    tier.id = row["user__userprofile__team__tier_id"]
+    team = Team(id=row["user__userprofile__team_id"], usage=row["user__userprofile__team__usage"], tier=tier)
+    return UserProfile(is_collaborator=row["user__userprofile__is_collaborator"], team=team)
+
+
+async def get_profile(scope, auth):
+    """
+    The request's user's UserProfile (with its team and tier), or None if they don't have one or the token isn't
+    valid. On Postgres this is one query awaited on the event loop, otherwise (or if that fails) it's the usual
+    auth.resolve() on a thread
+    """
+    if not auth.resolved and asyncdb.is_available():
+        try:
+            return await fetch_profile(auth.key)
+        except Exception as e:
+            logger.warning(f"Received Exception {e}")
+
+    await resolve_auth(scope, auth)
+    return auth.profile
+
+
+async def get_team_limits(scope, profile, limit):
+    # Only work out the one limit the route needs
+    if asyncdb.is_available():
+        try:
+            rows = await asyncdb.pool.fetch(LIMITS_QUERIES[limit], profile.team_id)
+            if rows:
+                row = rows[0]
+                plan = dict(has_billing=row["has_billing"] or row["has_custom_billing"])
+                return add_limits(plan, row, profile.team.tier, [limit])
+            # Otherwise the team doesn't have counters yet, which calculate_limits sorts out
+        except Exception as e:
+            logger.warning(f"Received Exception {e}")
+
+    return await get_bulkhead(scope["path"]).run(calculate_limits, profile.team, [limit])
+
+
+def get_request_auth(scope):
+    # Set by ResolveAuthMiddleware, None if there's no authorization header
+    return scope.get("state", {}).get("auth")
 
 
 def get_key_from_headers(headers):
@@ -0,0 +1,111 @@
+# The routes our middleware cares about, and what it should do on them.
+# These match the full path, so etebase routes start with /etebase, and a path matches with or without its trailing
+# slash. A "*" segment matches any single segment (eg. a collection UID) and a trailing "..." matches the path and
+# anything underneath it. The most specific match wins, so an exact route overrides a "..." route above it.
+# Collaborators can't use most of these. There might be overlap as some of these would be blocked anyway as the user
+# isn't a team owner, but this also lets us block mounted etebase routes
+
+
+class Policy:
+    def __init__(self, allow=False, block_collaborators=False, limit=None):
+        self.allow = allow  # Explicitly allowed, nothing else is checked
+        self.block_collaborators = block_collaborators
+        self.limit = limit  # Which of the team's plan limits this route uses up (projects | users | collaborators)
+
+
+ALLOW = Policy(allow=True)
+COLLABORATORS_BLOCKED = Policy(block_collaborators=True)
+
+# [(Method, Path, Policy)]
+POLICIES = [
+    # Projects
+    ("POST", "/etebase/api/v1/collection/...", COLLABORATORS_BLOCKED),
+    ("POST", "/etebase/api/v1/collection", Policy(block_collaborators=True, limit="projects")),
+    ("POST", "/etebase/api/v1/collection/list_multi", ALLOW),
+    ("POST", "/etebase/api/v1/collection/*/item/fetch_updates", ALLOW),
+    ("POST", "/etebase/api/v1/collection/*/item/transaction", ALLOW),
+    ("POST", "/etebase/api/v1/collection/*/item/batch", ALLOW),
+    # Invite User
+    ("POST", "/django/api/user/invite", Policy(block_collaborators=True, limit="users")),
+    ("POST", "/django/api/user/invite/collaborator", Policy(block_collaborators=True, limit="collaborators")),
+    # View team
+    ("GET", "/django/api/team/...", COLLABORATORS_BLOCKED),
+    # Any billing routes
+    ("*", "/django/api/billing/...", COLLABORATORS_BLOCKED),
+    ("POST", "/django/api/billing/create-checkout-session", ALLOW),
+    ("POST", "/django/api/billing/webhook", ALLOW),
+    # Create TrustedService
+    ("POST", "/django/api/trusted_service/...", COLLABORATORS_BLOCKED),
+    # Create Plugin
+    ("POST", "/django/api/plugin/...", COLLABORATORS_BLOCKED),
+]
+
+
+def split_path(path):
+    return [segment for segment in path.split("/") if segment]
+
+
+class _Node:
+    __slots__ = ("children", "exact", "prefix")
+
+    def __init__(self):
+        self.children = dict()
+        self.exact = None  # Policy for exactly this path
+        self.prefix = None  # Policy for this path and anything under it
+
+
+class RoutePolicies:
+    """
+    POLICIES, compiled into a trie of path segments per method. Most requests (ie. etebase syncing) don't match
+    anything and fall out after a dict lookup or two
+    """
+
+    def __init__(self, policies):
+        methods = {method for (method, _, _) in policies if method != "*"}
+
+        self.tries = {method: _Node() for method in methods}
+        self.any_method = _Node()
+
+        for (method, path, policy) in policies:
+            if method == "*":
+                roots = [*self.tries.values(), self.any_method]
+            else:
+                roots = [self.tries[method]]
+
+            for root in roots:
+                self._insert(root, path, policy)
+
+    @staticmethod
+    def _insert(root, path, policy):
+        segments = split_path(path)
+        is_prefix = segments[-1] == "..."
+        if is_prefix:
+            segments = segments[:-1]
+
+        node = root
+        for segment in segments:
+            node = node.children.setdefault(segment, _Node())
+
+        if is_prefix:
+            node.prefix = policy
+        else:
+            node.exact = policy
+
+    def match(self, method, path):
+        """The most specific Policy for this request, or None if we don't care about it"""
+        node = self.tries.get(method, self.any_method)
+        policy = node.prefix
+
+        for segment in split_path(path):
+            children = node.children
+            node = children.get(segment) or children.get("*")
+            if node is None:
+                return policy
+
+            if node.prefix is not None:
+                policy = node.prefix
+
+        return node.exact or policy
+
+
+route_policies = RoutePolicies(POLICIES)
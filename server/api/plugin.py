@@ -1,9 +1,18 @@
+import hashlib
+from collections import defaultdict
 from typing import List
 
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from django.http import HttpResponse
 from ninja import Router
 
-from myauth.models import Plugin
+from myauth.models import Plugin, TrustedService, UserProfile
+from server.cache import TTLCache
 from .schemas import PluginSchema, PluginCreated, Error
+from .renderers import dumps
 from django.core.exceptions import ObjectDoesNotExist
 from .trusted_service import process_collection_uids, is_valid_url
 from django_etebase.models import Collection
@@ -12,17 +21,71 @@ from loguru import logger
 
 router = Router()
 
+# Team -> (etag, JSON body) of its GET /plugin response. Every curate/annotate page asks for this and it rarely
+# changes, so we build it once and drop it whenever one of the team's plugins (or their collections) changes.
+# That only happens in the process that made the change, so entries also expire after PLUGIN_CACHE_TTL
+manifest_cache = TTLCache("plugins", max_size=settings.PLUGIN_CACHE_MAX_SIZE, ttl=settings.PLUGIN_CACHE_TTL)
+
+
+def build_manifest(team_id):
+    plugins = list(Plugin.objects.filter(team_id=team_id, type="Javascript").order_by("id"))
+
+    collection_uids = defaultdict(list)
+    for (plugin_id, uid) in Plugin.collections.through.objects.filter(plugin__in=plugins).values_list(
+        "plugin_id", "collection__uid"
+    ):
+        collection_uids[plugin_id].append(uid)
+
+    body = dumps(
+        [
+            PluginSchema(
+                type=p.type,
+                name=p.name,
+                url=p.url,
+                products=p.products,
+                enabled=p.enabled,
+                collection_uids=collection_uids[p.id],
+            ).dict()
+            for p in plugins
+        ]
+    )
+
+    # From the content, so every process gives the same manifest the same etag
+    etag = f'"{hashlib.sha1(body).hexdigest()}"'
+    return etag, body
+
+
+def get_manifest(team_id):
+    manifest = manifest_cache.get(team_id)
+    if manifest is None:
+        manifest = build_manifest(team_id)
+        manifest_cache.set(team_id, manifest)
+    return manifest
+
+
+def invalidate_manifests(team_ids):
+    # Once the change is committed, otherwise a request in between could cache what's about to be replaced
+    def invalidate():
+        for team_id in team_ids:
+            manifest_cache.delete(team_id)
+
+    transaction.on_commit(invalidate)
+
 
 @router.get("/", response={200: List[PluginSchema], 403: Error})
 def get_plugins(request):
     user = request.auth
 
-    filter_args = {"team_id": user.userprofile.team.id, "type": "Javascript"}
-    plugins = Plugin.objects.filter(**filter_args)
-    for p in plugins:
-        p.collection_uids = p.collections.values_list("uid", flat=True)
+    etag, body = get_manifest(user.userprofile.team_id)
 
-    return plugins
+    # The frontend always checks with us (no-cache), but only downloads the manifest again if it's changed
+    if etag in request.headers.get("If-None-Match", ""):
+        response = HttpResponse(status=304)
+    else:
+        response = HttpResponse(body, content_type="application/json")
+    response["ETag"] = etag
+    response["Cache-Control"] = "private, no-cache"
+    return response
 
 
 @router.post("/", response={200: PluginCreated, 403: Error, 500: Error, 400: Error})
@@ -54,9 +117,9 @@ def create_plugin(request, payload: PluginSchema):
             enabled=payload.enabled,
         )
 
-        process_collection_uids(plugin, payload.collection_uids)
+        unknown_collection_uids = process_collection_uids(plugin, payload.collection_uids)
 
-        return {"id": plugin.id}
+        return {"id": plugin.id, "unknown_collection_uids": unknown_collection_uids}
     except Exception as e:
         logger.error(e)
 
@@ -77,9 +140,9 @@ def update_plugin(request, payload: PluginSchema):
         plugin.enabled = payload.enabled
         plugin.save()
 
-        process_collection_uids(plugin, payload.collection_uids)
+        unknown_collection_uids = process_collection_uids(plugin, payload.collection_uids)
 
-        return {"id": plugin.id}
+        return {"id": plugin.id, "unknown_collection_uids": unknown_collection_uids}
     except Exception as e:
         logger.error(e)
 
@@ -99,3 +162,34 @@ def delete_plugin(request, payload: PluginSchema):
         return {"id": plugin_id}
     except Exception as e:
         logger.error(e)
+
+
+@receiver(post_save, sender=Plugin)
+@receiver(post_delete, sender=Plugin)
+def plugin_changed(sender, instance, **kwargs):
+    invalidate_manifests([instance.team_id])
+
+
+@receiver(post_save, sender=TrustedService)
+@receiver(post_delete, sender=TrustedService)
+def trusted_service_changed(sender, instance, **kwargs):
+    invalidate_manifests(list(Plugin.objects.filter(id=instance.plugin_id).values_list("team_id", flat=True)))
+
+
+@receiver(m2m_changed, sender=Plugin.collections.through)
+def plugin_collections_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith("post_"):
+        return
+
+    if reverse:
+        # instance is a Collection
+        plugins = Plugin.objects.filter(id__in=pk_set) if pk_set else Plugin.objects.filter(collections=instance)
+        invalidate_manifests(list(plugins.values_list("team_id", flat=True).distinct()))
+    else:
+        invalidate_manifests([instance.team_id])
+
+
+# Deleting a collection removes it from plugins without an m2m_changed, and its UID would still be in the manifest
+@receiver(post_delete, sender=Collection)
+def collection_deleted(sender, instance, **kwargs):
+    invalidate_manifests(list(UserProfile.objects.filter(user_id=instance.owner_id).values_list("team_id", flat=True)))
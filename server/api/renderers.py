@@ -0,0 +1,34 @@
+# The API's responses are rendered with orjson, which is several times faster than json with ninja's
+# DjangoJSONEncoder and handles datetimes, dates and UUIDs itself. Datetimes come out as eg.
+# "2022-03-01T12:00:00.123456Z" (microseconds rather than Django's milliseconds), which JS parses the same.
+# If orjson isn't installed we render exactly as ninja would
+import json
+
+from ninja.renderers import BaseRenderer
+from ninja.responses import NinjaJSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_encoder = NinjaJSONEncoder()
+
+
+def default(o):
+    # Whatever orjson can't do itself (pydantic models, Decimals, lazy translations...), the same as ninja would
+    return _encoder.default(o)
+
+
+def dumps(data) -> bytes:
+    if orjson is None:
+        return json.dumps(data, cls=NinjaJSONEncoder).encode()
+
+    return orjson.dumps(data, default=default, option=orjson.OPT_UTC_Z | orjson.OPT_NON_STR_KEYS)
+
+
+class ORJSONRenderer(BaseRenderer):
+    media_type = "application/json"
+
+    def render(self, request, data, *, response_status):
+        return dumps(data)
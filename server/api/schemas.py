@@ -1,3 +1,4 @@
+from datetime import date
 from typing import List, Optional, Dict, Union
 from ninja import Schema
 from ninja.orm import create_schema
@@ -24,6 +25,7 @@ class PluginSchema(Schema):
 
 class PluginCreated(Schema):
     id: int
+    unknown_collection_uids: List[str] = []  # Any collection_uids we couldn't find (these are left out)
 
 
 class TrustedServiceSchema(PluginSchema):
@@ -32,6 +34,7 @@ class TrustedServiceSchema(PluginSchema):
 
 class TrustedServiceCreated(Schema):
     id: int
+    unknown_collection_uids: List[str] = []  # Any collection_uids we couldn't find (these are left out)
 
 
 class Error(Schema):
@@ -97,6 +100,24 @@ class TeamsOut(Schema):
     profiles: List[UserProfileOut]
     pending_invites: List[InvitedProfileOut]
     owner: OwnerOut
+    next_cursor: Optional[str]  # If there's more, pass this as the cursor to get the next page
+
+
+class MemberUsage(Schema):
+    id: int
+    usage: int
+
+
+class TeamUsagePoint(Schema):
+    date: date  # The first day of the day/week/month
+    usage: int  # Average over the period, in MB
+    peak_usage: int
+    members: List[MemberUsage]
+
+
+class TeamUsageOut(Schema):
+    resolution: str
+    points: List[TeamUsagePoint]
 
 
 class CheckoutSessionIn(Schema):
@@ -1,42 +1,141 @@
-import requests
+# Tunnel for the frontend's Sentry events, so they aren't blocked by ad blockers.
+# This is a plain ASGI endpoint (mounted in server/asgi.py, in front of Django) as an error storm in the frontend
+# shouldn't tie up the threads that serve the API. We only read the envelope's header line (for the DSN), put the
+# envelope on a bounded queue and return. A few workers forward them to Sentry over a pooled session, and if the
+# queue is full we drop the event and tell the SDK to back off
+import asyncio
 import json
-from ninja import Router
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+from django.conf import settings
 from loguru import logger
-from myauth.models import UserProfile, Tier, Team
-from .schemas import UserProfileIn, UserProfileOut, Error
+from requests.adapters import HTTPAdapter
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response
 
-router = Router()
+# We only forward to Sentry, not wherever the envelope says
+ALLOWED_HOST_SUFFIX = ".sentry.io"
 
+session = requests.Session()
+session.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=settings.SENTRY_TUNNEL_WORKERS))
+
+
+class BadEnvelope(Exception):
+    pass
+
+
+class EnvelopeTooLarge(Exception):
+    pass
 
-# Submit a Sentry event
-@router.post("/", response={200: None, 409: Error}, auth=None)
-def post_event(request):
-    logger.info("POST request on Sentry tunnel endpoint")
-    logger.debug(request.body.decode("utf-8").split("\n"))
-    [envelopeHeader, itemHeader, item] = request.body.decode("utf-8").split("\n")
-    envelopeHeader = json.loads(envelopeHeader)
-    itemHeader = json.loads(itemHeader)
-    item = json.loads(item)
 
+def get_envelope_url(header_line):
+    # The envelope header is the first line, eg. {"dsn": "https://<key>@o123.ingest.sentry.io/456", ...}
     try:
-        dsn = envelopeHeader["dsn"][:-8:]  # get dsn url
-        project_id = envelopeHeader["dsn"][-7::]  # get project id
-        url = f"{dsn}/api/{project_id}/envelope/"
-        logger.info(f"Attempting to send event to {url}")
-        r = requests.post(url, data=request.body)
-        status_code = r.status_code
-        if status_code >= 400 and status_code < 500:
-            message = f"Failed to tunnel frontend sentry event - received {status_code}"
-            logger.error(message)
-        elif status_code >= 200 and status_code < 300:
-            message = f"Successfully tunnelled frontend sentry event - received {status_code}"
-            logger.success(message)
-        else:
-            message = f"Unknown outcome of tunnelling frontend sentry event - received {status_code}"
-            logger.warning(message)
+        dsn = urlparse(json.loads(header_line)["dsn"])
+        project_id = dsn.path.strip("/")
     except Exception as e:
-        status_code = 400
-        message = e
+        raise BadEnvelope(f"Can't read DSN - {e}")
+
+    host = dsn.hostname or ""
+    if dsn.scheme != "https" or not host.endswith(ALLOWED_HOST_SUFFIX) or not project_id.isdigit():
+        raise BadEnvelope(f"Not a Sentry DSN - {dsn.scheme}://{host}")
+
+    return f"https://{host}/api/{project_id}/envelope/"
+
+
+async def read_envelope(request):
+    if int(request.headers.get("content-length") or 0) > settings.SENTRY_TUNNEL_MAX_SIZE:
+        raise EnvelopeTooLarge()
+
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > settings.SENTRY_TUNNEL_MAX_SIZE:
+            raise EnvelopeTooLarge()
+
+    return bytes(body)
+
+
+class SentryTunnel:
+    def __init__(self, queue_size, workers):
+        self.queue_size = queue_size
+        self.workers = workers
+        self.queue = None  # Created on first use, so it belongs to the server's event loop
+        self.tasks = []
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="sentry-tunnel")
+
+        self.forwarded = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def start(self):
+        self.queue = asyncio.Queue(maxsize=self.queue_size)
+        self.tasks = [asyncio.ensure_future(self.work()) for _ in range(self.workers)]
+
+    def put(self, url, envelope):
+        if self.queue is None:
+            self.start()
+
+        try:
+            self.queue.put_nowait((url, envelope))
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            if self.dropped % 100 == 1:
+                logger.warning(f"Sentry tunnel queue is full, {self.dropped} event(s) dropped so far")
+            return False
+
+    async def work(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            url, envelope = await self.queue.get()
+            try:
+                await loop.run_in_executor(self.executor, self.forward, url, envelope)
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Failed to tunnel frontend sentry event - {e}")
+            finally:
+                self.queue.task_done()
+
+    def forward(self, url, envelope):
+        r = session.post(
+            url,
+            data=envelope,
+            headers={"Content-Type": "application/x-sentry-envelope"},
+            timeout=(settings.SENTRY_TUNNEL_CONNECT_TIMEOUT, settings.SENTRY_TUNNEL_TIMEOUT),
+        )
+        if r.status_code >= 400:
+            raise Exception(f"received {r.status_code}")
+
+        self.forwarded += 1
+
+    def stats(self):
+        return dict(
+            queued=self.queue.qsize() if self.queue is not None else 0,
+            forwarded=self.forwarded,
+            failed=self.failed,
+            dropped=self.dropped,
+        )
+
+
+tunnel = SentryTunnel(queue_size=settings.SENTRY_TUNNEL_QUEUE_SIZE, workers=settings.SENTRY_TUNNEL_WORKERS)
+
+
+# Submit a Sentry event
+async def post_event(request: Request):
+    try:
+        envelope = await read_envelope(request)
+        url = get_envelope_url(envelope.split(b"\n", 1)[0])
+    except EnvelopeTooLarge:
+        return JSONResponse({"message": "Envelope too large"}, status_code=413)
+    except BadEnvelope as e:
         logger.warning(f"Received Exception {e}")
+        return JSONResponse({"message": "Invalid envelope"}, status_code=400)
+
+    if not tunnel.put(url, envelope):
+        # The Sentry SDK backs off when it sees this
+        return Response(status_code=429, headers={"Retry-After": str(settings.SENTRY_TUNNEL_RETRY_AFTER)})
 
-    return status_code, {"message": message}
+    return Response(status_code=200)
@@ -0,0 +1,36 @@
+from django.http import HttpResponse
+
+from .renderers import dumps
+
+
+class StreamingJsonResponse(HttpResponse):
+    """
+    Works like Django's StreamingHttpResponse, sending chunks as they're made rather than building the whole body in
+    memory. Ninja only passes a view's response through untouched if it's an HttpResponse, which
+    StreamingHttpResponse isn't, hence this
+    """
+
+    streaming = True
+
+    def __init__(self, chunks, status=200):
+        super().__init__(content_type="application/json", status=status)
+        self.streaming_content = chunks
+
+    @property
+    def streaming_content(self):
+        return map(self.make_bytes, self._iterator)
+
+    @streaming_content.setter
+    def streaming_content(self, value):
+        self._iterator = iter(value)
+
+    def __iter__(self):
+        return self.streaming_content
+
+    def getvalue(self):
+        return b"".join(self.streaming_content)
+
+
+def to_json(schema):
+    # The same JSON the API would have given us for this (see renderers.py)
+    return dumps(schema.dict()).decode()
@@ -1,35 +1,197 @@
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from datetime import date, datetime, timedelta, timezone
+
+from django.conf import settings
 from ninja import Router
 from loguru import logger
 
-from myauth.models import User, Invite
-from .schemas import TeamsOut, Error
+from myauth.models import Invite, TeamUsage, UserProfile
+from myauth.usage import month_start, week_start
+from .schemas import TeamsOut, TeamUsageOut, Error, InvitedProfileOut, OwnerOut, UserProfileOut
+from .streaming import StreamingJsonResponse, to_json
 
 router = Router()
 
 
+# Filters for GET /team. Profiles are members who've accepted, invites are pending
+ROLES = {
+    "member": (dict(is_collaborator=False, is_trusted_service=False), dict(is_collaborator=False)),
+    "collaborator": (dict(is_collaborator=True, is_trusted_service=False), dict(is_collaborator=True)),
+    "trusted_service": (dict(is_trusted_service=True), None),  # Trusted services aren't invited
+}
+STATUSES = ("accepted", "pending")
+
+
+def encode_cursor(section, after_id):
+    return urlsafe_b64encode(f"{section}:{after_id}".encode()).decode()
+
+
+def decode_cursor(cursor):
+    # -> (section, id we got up to), where section is "profiles" then "pending_invites"
+    section, after_id = urlsafe_b64decode(cursor.encode()).decode().split(":")
+    if section not in ("profiles", "pending_invites"):
+        raise ValueError(section)
+    return section, int(after_id)
+
+
+def stream_team(owner, sections, limit):
+    """
+    Writes out the TeamsOut JSON as we read the rows, so a big team is never all in memory at once. If there's a
+    limit, we stop after that many rows (profiles, then invites) and add a cursor for the next page
+    """
+    yield f'{{"owner": {to_json(OwnerOut.from_orm(owner))}'
+    next_cursor = None
+    remaining = limit
+
+    for section, rows, write, last_id in sections:
+        yield f', "{section}": ['
+
+        if next_cursor is None:
+            first = True
+            for row in rows.iterator() if remaining is None else rows[: remaining + 1]:
+                if remaining == 0:
+                    next_cursor = encode_cursor(section, last_id)
+                    break
+
+                yield ("" if first else ", ") + write(row)
+                first = False
+                last_id = row.pk
+                if remaining is not None:
+                    remaining -= 1
+
+        yield "]"
+
+    yield f', "next_cursor": {json.dumps(next_cursor)}}}'
+
+
+def write_profile(team):
+    def write(profile):
+        profile.id = profile.user_id
+        profile.email = profile.user.email
+        profile.team = team
+        return to_json(UserProfileOut.from_orm(profile))
+
+    return write
+
+
+def write_invite(invite):
+    return to_json(InvitedProfileOut.from_orm(invite))
+
+
 @router.get(
     "/",
-    response={200: TeamsOut, 403: Error},
+    response={200: TeamsOut, 403: Error, 422: Error},
 )
-def get_team(request):
+def get_team(request, role: str = None, status: str = None, limit: int = None, cursor: str = None):
+    """
+    The team's members and pending invites. Everything, unless you pass a limit, in which case follow next_cursor
+    for the rest. You can also filter by role (member | collaborator | trusted_service) and status (accepted |
+    pending)
+    """
     user = request.auth
 
     if user.userprofile.is_collaborator or user.userprofile.is_trusted_service:
         return 403, {"message": "Only owners or members can view the team"}
 
-    users = User.objects.filter(userprofile__team__owner_id=user.userprofile.team.owner)
+    if role is not None and role not in ROLES:
+        return 422, {"message": f"role must be one of {', '.join(ROLES)}"}
+    if status is not None and status not in STATUSES:
+        return 422, {"message": f"status must be one of {', '.join(STATUSES)}"}
+    if limit is not None and not 0 < limit <= settings.TEAM_PAGE_MAX_SIZE:
+        return 422, {"message": f"limit must be between 1 and {settings.TEAM_PAGE_MAX_SIZE}"}
+
+    try:
+        section, after_id = decode_cursor(cursor) if cursor else ("profiles", 0)
+    except Exception:
+        return 422, {"message": "Invalid cursor"}
+
+    profile_filters, invite_filters = ROLES[role] if role is not None else (dict(), dict())
 
-    profiles = []
-    for u in users:
-        u.userprofile.id = u.id
-        u.userprofile.email = u.email
-        profiles.append(u.userprofile)
+    # Auth already loaded the team, its tier and owner, every profile shares them rather than loading its own
+    team = user.userprofile.team
 
-    # Add invited, but not accepted users
-    invites = Invite.objects.filter(from_team_id=user.userprofile.team.id, accepted_date=None).values(
-        "email", "sent_date", "is_collaborator"
-    )
+    profiles = UserProfile.objects.none()
+    if status != "pending" and section == "profiles":
+        profiles = (
+            UserProfile.objects.filter(team_id=team.id, user_id__gt=after_id, **profile_filters)
+            .select_related("user")
+            .order_by("user_id")
+        )
 
     # We send trusted services as users too and filter them frontend
+    invites = Invite.objects.none()
+    if status != "accepted" and invite_filters is not None:
+        invites = Invite.objects.filter(
+            from_team_id=team.id,
+            accepted_date=None,
+            id__gt=after_id if section == "pending_invites" else 0,
+            **invite_filters,
+        ).order_by("id")
+
+    sections = [
+        ("profiles", profiles, write_profile(team), after_id if section == "profiles" else 0),
+        ("pending_invites", invites, write_invite, after_id if section == "pending_invites" else 0),
+    ]
+    return StreamingJsonResponse(stream_team(team.owner, sections, limit))
+
+
+# How far back we go if they don't say, for each resolution
+USAGE_RESOLUTIONS = {
+    "day": timedelta(days=90),
+    "week": timedelta(days=365),
+    "month": None,  # Everything
+}
+
+
+def bucket_team_usage(rows, start_of):
+    # Daily TeamUsage -> a point per day/week/month, averaging (and taking the peak of) the days in it
+    buckets = dict()
+    for row in rows:
+        buckets.setdefault(start_of(row.date), []).append(row)
+
+    points = []
+    for start, days in buckets.items():
+        members = dict()
+        for day in days:
+            for user_id, usage in day.members.items():
+                members.setdefault(user_id, []).append(usage)
+
+        points.append(
+            dict(
+                date=start,
+                usage=round(sum(day.usage for day in days) / len(days)),
+                peak_usage=max(day.usage for day in days),
+                members=[
+                    dict(id=int(user_id), usage=round(sum(usages) / len(usages))) for user_id, usages in members.items()
+                ],
+            )
+        )
+
+    return points
+
+
+@router.get(
+    "/usage",
+    response={200: TeamUsageOut, 403: Error, 422: Error},
+)
+def get_team_usage(request, resolution: str = "day", since: date = None):
+    user = request.auth
+
+    if user.userprofile.is_collaborator or user.userprofile.is_trusted_service:
+        return 403, {"message": "Only owners or members can view the team"}
+
+    if resolution not in USAGE_RESOLUTIONS:
+        return 422, {"message": f"resolution must be one of {', '.join(USAGE_RESOLUTIONS)}"}
+
+    if since is None and USAGE_RESOLUTIONS[resolution] is not None:
+        since = datetime.now(tz=timezone.utc).date() - USAGE_RESOLUTIONS[resolution]
+
+    # These are written nightly, so this is at most a row per day for one team
+    rows = TeamUsage.objects.filter(team_id=user.userprofile.team_id).order_by("date")
+    if since is not None:
+        rows = rows.filter(date__gte=since)
+
+    start_of = {"day": lambda day: day, "week": week_start, "month": month_start}[resolution]
 
-    return {"profiles": profiles, "pending_invites": list(invites), "owner": user.userprofile.team.owner}
+    return {"resolution": resolution, "points": bucket_team_usage(rows, start_of)}
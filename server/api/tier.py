@@ -1,17 +1,102 @@
+import copy
+import hashlib
+import threading
+import time
 from typing import List
 
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
+from loguru import logger
 from ninja import Router
 
 from myauth.models import Tier
 from .schemas import TierSchema
+from .renderers import dumps
 
 router = Router()
 
 
+class TierCatalog:
+    """
+    Every tier, read and serialised once. The pricing pages and sign up ask for these constantly and they almost
+    never change, so we keep them in memory until a Tier is saved or deleted (or TIER_CATALOG_TTL passes, as other
+    processes don't see our signals). version is a hash of the content, so it's the same in every process
+    """
+
+    def __init__(self):
+        tiers = list(Tier.objects.all().order_by("id"))
+
+        self.body = dumps([TierSchema.from_orm(tier).dict() for tier in tiers])
+        self.version = hashlib.sha1(self.body).hexdigest()
+        self.etag = f'"{self.version}"'
+        self.by_name = dict()
+        self.duplicate_names = set()
+        for tier in tiers:
+            if tier.name in self.by_name:
+                self.duplicate_names.add(tier.name)
+            self.by_name.setdefault(tier.name, tier)
+        if self.duplicate_names:
+            logger.error(f"More than one tier is named {', '.join(sorted(self.duplicate_names))}")
+        self.built_at = time.monotonic()
+
+    def get_by_name(self, name):
+        # Raises like Tier.objects.get(name=name) would, rather than picking one of several
+        if name in self.duplicate_names:
+            raise Tier.MultipleObjectsReturned(f"More than one tier named {name}")
+        try:
+            return copy.copy(self.by_name[name])  # So callers can't change ours
+        except KeyError:
+            raise Tier.DoesNotExist(f"No tier named {name}")
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog():
+    global _catalog
+
+    catalog = _catalog
+    if catalog is None or time.monotonic() - catalog.built_at > settings.TIER_CATALOG_TTL:
+        with _catalog_lock:
+            if _catalog is catalog:  # Nobody else rebuilt it while we waited
+                _catalog = TierCatalog()
+            catalog = _catalog
+
+    return catalog
+
+
+def get_tier_by_name(name):
+    return get_catalog().get_by_name(name)
+
+
+def invalidate_catalog():
+    global _catalog
+    _catalog = None
+
+
+@receiver(post_save, sender=Tier)
+@receiver(post_delete, sender=Tier)
+def tier_changed(sender, instance, **kwargs):
+    # Once the change is committed, otherwise a request in between could rebuild it from the old rows
+    transaction.on_commit(invalidate_catalog)
+
+
 @router.get("/", response=List[TierSchema], auth=None)
 def list_tiers(request):
-    return Tier.objects.all()
+    catalog = get_catalog()
+
+    if catalog.etag in request.headers.get("If-None-Match", ""):
+        response = HttpResponse(status=304)
+    else:
+        response = HttpResponse(catalog.body, content_type="application/json")
+    response["ETag"] = catalog.etag
+    response["Cache-Control"] = f"public, max-age={settings.TIER_CATALOG_MAX_AGE}"
+    return response
 
 
 @router.get("/{tier_id}", response=TierSchema)
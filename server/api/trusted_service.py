@@ -2,6 +2,8 @@ from datetime import datetime, timezone
 from typing import List, Dict, Union
 from django.core.exceptions import ObjectDoesNotExist, ValidationError
 from django.core.validators import URLValidator
+from django.db import transaction
+from django.db.models import Prefetch
 
 from ninja import Router
 
@@ -14,17 +16,33 @@ from .schemas import TrustedServiceSchema, TrustedServiceCreated, Error
 router = Router()
 
 
-def process_collection_uids(model, collection_uids):
-    if collection_uids is not None:
-        model.collections.clear()
-        for uid in collection_uids:
-            try:
-                collection = Collection.objects.get(uid=uid)
-                model.collections.add(collection)
+def process_collection_uids(plugin, collection_uids):
+    """
+    Sets the plugin's collections to exactly these, only adding and removing the links that change.
+    Returns any UIDs that aren't one of the team's collections (these are skipped)
+    """
+    if collection_uids is None:
+        return []
 
-            except ObjectDoesNotExist:
-                logger.error(f"Project {uid} does not exist.")
-        model.save()
+    # The frontend can send these as they come from GET, ie. {uid, is_invite_pending}
+    uids = {getattr(uid, "uid", uid) for uid in collection_uids}
+    collection_ids = dict(
+        Collection.objects.filter(uid__in=uids, owner__userprofile__team_id=plugin.team_id).values_list("uid", "id")
+    )
+
+    unknown_uids = sorted(uids - collection_ids.keys())
+    if unknown_uids:
+        logger.error(f"Projects {unknown_uids} do not exist.")
+
+    wanted = set(collection_ids.values())
+    with transaction.atomic():
+        current = set(plugin.collections.values_list("id", flat=True))
+        if current - wanted:
+            plugin.collections.remove(*(current - wanted))
+        if wanted - current:
+            plugin.collections.add(*(wanted - current))
+
+    return unknown_uids
 
 
 def is_valid_url(url):
@@ -41,19 +59,37 @@ def is_valid_url(url):
 def get_trusted_service(request, response=TrustedServiceSchema):
     user = request.auth
 
-    plugins = Plugin.objects.filter(team_id=user.userprofile.team.id).exclude(type="Javascript")
-
+    # The plugins with their trusted service (and its user), then their collections, then the collections those
+    # users are actually members of. Three queries however many plugins there are
+    plugins = list(
+        Plugin.objects.filter(team_id=user.userprofile.team.id)
+        .exclude(type="Javascript")
+        .select_related("trustedservice__user")
+        .prefetch_related(Prefetch("collections", queryset=Collection.objects.only("id", "uid")))
+    )
+
+    ts_user_ids = [p.trustedservice.user_id for p in plugins if hasattr(p, "trustedservice")]
+    current_collections = dict()
+    for user_id, uid in CollectionMember.objects.filter(user_id__in=ts_user_ids).values_list(
+        "user_id", "collection__uid"
+    ):
+        current_collections.setdefault(user_id, set()).add(uid)
+
+    trusted_services = []
     for p in plugins:
-        ts = TrustedService.objects.get(plugin_id=p.id)
-        current_collections = CollectionMember.objects.filter(user__email=ts.user.email).values_list(
-            "collection__uid", flat=True
-        )
+        if not hasattr(p, "trustedservice"):
+            logger.error(f"Plugin {p.id} doesn't have a trusted service")
+            continue
+
+        ts = p.trustedservice
+        member_of = current_collections.get(ts.user_id, set())
         p.collection_uids: List[Dict[str, Union[str, bool]]] = [
-            {"uid": uid, "is_invite_pending": uid not in current_collections}
-            for uid in p.collections.values_list("uid", flat=True)
+            {"uid": c.uid, "is_invite_pending": c.uid not in member_of} for c in p.collections.all()
         ]
         p.username = ts.user.username
-    return plugins
+        trusted_services.append(p)
+
+    return trusted_services
 
 
 @router.post("/", response={200: TrustedServiceCreated, 403: Error, 409: Error, 500: Error, 400: Error})
@@ -103,14 +139,14 @@ def create_trusted_service(request, payload: TrustedServiceSchema):
             enabled=payload.enabled,
         )
 
-        process_collection_uids(plugin, payload.collection_uids)
+        unknown_collection_uids = process_collection_uids(plugin, payload.collection_uids)
 
         ts = TrustedService.objects.create(
             user_id=ts_user.id,
             plugin_id=plugin.id,
         )
 
-        return {"id": ts.id}
+        return {"id": ts.id, "unknown_collection_uids": unknown_collection_uids}
     except Exception as e:
         logger.error(e)
 
@@ -132,14 +168,14 @@ def update_trusted_service(request, payload: TrustedServiceSchema):
         plugin.enabled = payload.enabled
         plugin.save()
 
-        process_collection_uids(plugin, payload.collection_uids)
+        unknown_collection_uids = process_collection_uids(plugin, payload.collection_uids)
 
         ts = TrustedService.objects.get(plugin_id=plugin.id)
         user_profile = ts.user.userprofile
         user_profile.name = payload.name
         user_profile.save()
 
-        return {"id": ts.id}
+        return {"id": ts.id, "unknown_collection_uids": unknown_collection_uids}
     except Exception as e:
         logger.error(e)
 
@@ -2,16 +2,15 @@ from uuid import uuid4
 from datetime import datetime, timezone, timedelta
 from loguru import logger
 from django.shortcuts import get_object_or_404
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail
 
 from django.core.exceptions import ObjectDoesNotExist
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 from ninja import Router
 
 from django.conf import settings
 from myauth.models import UserProfile, Tier, Team, Invite, User, Recovery, EmailVerification
 from .billing import create_stripe_customer, create_stripe_subscription
+from .tier import get_tier_by_name
 from .schemas import (
     UserProfileIn,
     UserProfileUpdateIn,
@@ -22,7 +21,7 @@ from .schemas import (
     InviteOut,
     AccountRecoveryOut,
 )
-import server.emails as email_template
+from server.outbox import queue_email
 
 
 router = Router()
@@ -71,7 +70,7 @@ def create_user(request, payload: UserProfileIn):
                 return 409, {"message": "This tier is unavailable"}
 
         else:
-            tier = Tier.objects.get(name__exact=settings.DEFAULT_PLAN)
+            tier = get_tier_by_name(settings.DEFAULT_PLAN)
 
         team = Team.objects.create(owner_id=user.id, name=f"{payload.name}'s Team", tier_id=tier.id, usage=0)
 
@@ -116,24 +115,12 @@ def create_user(request, payload: UserProfileIn):
     now = datetime.now(tz=timezone.utc)
     now_plus_24h = now + timedelta(hours=24)
 
-    validation = EmailVerification.objects.create(uid=uid, user_profile=user.userprofile, expiry_date=now_plus_24h)
-    validation.save()
+    # The email is sent in the background, but only once the verification it links to exists
+    with transaction.atomic():
+        EmailVerification.objects.create(uid=uid, user_profile=user.userprofile, expiry_date=now_plus_24h)
+        queue_email(user.email, "verify_email", {"verify_url": settings.BASE_URL + "/verify_email/" + uid})
 
     logger.info("email verification request created")
-    try:
-        message = Mail(
-            from_email="contact@gliff.ai",
-            to_emails=user.email,
-        )
-        message.dynamic_template_data = {
-            "verify_url": settings.BASE_URL + "/verify_email/" + uid,
-        }
-        message.template_id = email_template.id["verify_email"]
-
-        sendgrid_client = SendGridAPIClient(settings.SENDGRID_API_KEY)
-        sendgrid_client.send(message)
-    except Exception as e:
-        logger.error(e)
 
     return user_profile
 
@@ -191,28 +178,13 @@ def create_invite(request, email, is_collaborator):
             logger.info(f"Received ObjectDoesNotExist error {e}")
             pass
 
-        invite = Invite.objects.create(uid=uid, email=email, from_team_id=team.id, is_collaborator=is_collaborator)
+        with transaction.atomic():
+            Invite.objects.create(uid=uid, email=email, from_team_id=team.id, is_collaborator=is_collaborator)
 
-        invite.save()
+            # TODO slightly different email for a collaborator?
+            queue_email(email, "invite_to_team", {"invite_url": settings.BASE_URL + "/signup?invite_id=" + uid})
 
         logger.info("invite created")
-        try:
-            # TODO email sending should be a function
-
-            # TODO slightly different email for a collaborator?
-            message = Mail(
-                from_email="contact@gliff.ai",
-                to_emails=email,
-            )
-            message.dynamic_template_data = {
-                "invite_url": settings.BASE_URL + "/signup?invite_id=" + uid,
-            }
-            message.template_id = email_template.id["invite_to_team"]
-
-            sendgrid_client = SendGridAPIClient(settings.SENDGRID_API_KEY)
-            sendgrid_client.send(message)
-        except Exception as e:
-            logger.error(f"sending invite email {e}")
 
         return 200, {"id": uid}
 
@@ -273,24 +245,11 @@ def request_validation_email(request, payload: CreateInvite):
         now = datetime.now(tz=timezone.utc)
         now_plus_24h = now + timedelta(hours=24)
 
-        validation = EmailVerification.objects.create(uid=uid, user_profile=user.userprofile, expiry_date=now_plus_24h)
-        validation.save()
+        with transaction.atomic():
+            EmailVerification.objects.create(uid=uid, user_profile=user.userprofile, expiry_date=now_plus_24h)
+            queue_email(user.email, "verify_email", {"verify_url": settings.BASE_URL + "/verify_email/" + uid})
 
         logger.info("email verification request created")
-        try:
-            message = Mail(
-                from_email="contact@gliff.ai",
-                to_emails=user.email,
-            )
-            message.dynamic_template_data = {
-                "verify_url": settings.BASE_URL + "/verify_email/" + uid,
-            }
-            message.template_id = email_template.id["verify_email"]
-
-            sendgrid_client = SendGridAPIClient(settings.SENDGRID_API_KEY)
-            sendgrid_client.send(message)
-        except Exception as e:
-            logger.error(e)
 
         return 201, None
 
@@ -329,25 +288,11 @@ def create_recovery(request, payload: CreateInvite):
         uid = str(uuid4())
         now = datetime.now(tz=timezone.utc)
         now_plus_10 = now + timedelta(minutes=10)
-        recovery = Recovery.objects.create(uid=uid, user_profile=user.userprofile, expiry_date=now_plus_10)
-
-        recovery.save()
+        with transaction.atomic():
+            Recovery.objects.create(uid=uid, user_profile=user.userprofile, expiry_date=now_plus_10)
+            queue_email(payload.email, "recover_account", {"recovery_url": settings.BASE_URL + "/recover?uid=" + uid})
 
         logger.info("recovery key created")
-        try:
-            message = Mail(
-                from_email="contact@gliff.ai",
-                to_emails=payload.email,
-            )
-            message.dynamic_template_data = {
-                "recovery_url": settings.BASE_URL + "/recover?uid=" + uid,
-            }
-            message.template_id = email_template.id["recover_account"]
-
-            sendgrid_client = SendGridAPIClient(settings.SENDGRID_API_KEY)
-            sendgrid_client.send(message)
-        except Exception as e:
-            logger.error(e)
 
         return 201
 
@@ -379,32 +324,22 @@ def verify_email(request, verification_id: str):
             EmailVerification, uid=verification_id, expiry_date__gte=datetime.now(tz=timezone.utc)
         )
 
-        profile = UserProfile.objects.get(user_id=validation.user_profile_id)
+        with transaction.atomic():
+            profile = UserProfile.objects.get(user_id=validation.user_profile_id)
 
-        profile.email_verified = datetime.now(tz=timezone.utc)
+            profile.email_verified = datetime.now(tz=timezone.utc)
 
-        profile.save()
+            profile.save()
 
-        user = get_object_or_404(User, id=validation.user_profile_id)
-        user.is_active = True
+            user = get_object_or_404(User, id=validation.user_profile_id)
+            user.is_active = True
 
-        user.save()
-
-        validation.delete()
-
-        # Send welcome email
-        try:
-            message = Mail(
-                from_email="contact@gliff.ai",
-                to_emails=profile.user.email,
-            )
+            user.save()
 
-            message.template_id = email_template.id["welcome"]
+            validation.delete()
 
-            sendgrid_client = SendGridAPIClient(settings.SENDGRID_API_KEY)
-            sendgrid_client.send(message)
-        except Exception as e:
-            logger.error(e)
+            # Send welcome email
+            queue_email(user.email, "welcome")
 
         return 200, None
 
@@ -2,22 +2,23 @@ import os
 import django
 from loguru import logger
 from django.conf import settings
-from django.core.wsgi import get_wsgi_application
 from fastapi import FastAPI, HTTPException
 from etebase_fastapi.main import create_application
-from fastapi.middleware.wsgi import WSGIMiddleware
 from starlette.middleware.cors import CORSMiddleware
 
-from server.api.middleware import EnforcePlanLimitsMiddleware, EnforceCollabMiddleware
+from server.api.middleware import EnforcePoliciesMiddleware, ResolveAuthMiddleware
+from server.api.sentry import post_event
+from server import asyncdb
+from server.bulkheads import use_bulkheads
+from server.stats import start_logging_stats, stop_logging_stats
+from server.handlers import DjangoHandler
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "server.settings.base")
 django.setup()
 
 
 def get_application() -> FastAPI:
-    middlewares = [EnforcePlanLimitsMiddleware, EnforceCollabMiddleware]
-
-    etebase_app = create_application(middlewares=middlewares)
+    etebase_app = create_application()
 
     app = FastAPI(title="STORE", debug=settings.DEBUG)
     app.add_middleware(
@@ -28,15 +29,28 @@ def get_application() -> FastAPI:
         allow_headers=["*"],
     )
 
-    for middleware in middlewares:
-        app.add_middleware(middleware)
+    # This sees every request (including the mounted etebase ones) so it's only added here, once
+    app.add_middleware(EnforcePoliciesMiddleware)
+
+    # Added last so it runs first, everything after it shares the request's auth
+    app.add_middleware(ResolveAuthMiddleware)
+
+    # The Sentry tunnel is served here rather than by Django, at the same path it's always had
+    app.add_route("/django/api/tunnel/", post_event, methods=["POST"])
+    app.add_route("/django/api/tunnel", post_event, methods=["POST"])
 
     # We mount Django (and the API, via urls.py) under /django
-    app.mount("/django", WSGIMiddleware(get_wsgi_application()))
+    app.mount("/django", DjangoHandler())
 
     # All the etebase api routes are here
     app.mount("/etebase", etebase_app)
 
+    # Each class of route gets its own threads (see server/bulkheads.py)
+    app.add_event_handler("startup", use_bulkheads)
+    app.add_event_handler("startup", start_logging_stats)
+    app.add_event_handler("shutdown", asyncdb.pool.close)
+    app.add_event_handler("shutdown", stop_logging_stats)
+
     return app
 
 
@@ -0,0 +1,133 @@
+# A small pool of asynchronous Postgres connections, for the few queries our ASGI middleware makes on every request
+# it cares about. Django 3.1's ORM can only be used from a thread, so each of those cost a trip to the thread pool
+# (and a DB connection of the thread's own) while the request waited. psycopg2 can run queries without blocking,
+# so here they're awaited on the event loop instead. Queries are still built with the ORM and just compiled to SQL
+# here, and this only works on Postgres, so callers should check is_available() and fall back to the ORM
+import asyncio
+
+from django.conf import settings
+from django.db import connections
+
+try:
+    import psycopg2
+    from psycopg2.extensions import POLL_OK, POLL_READ, POLL_WRITE
+except ImportError:
+    psycopg2 = None
+
+
+def is_available():
+    return psycopg2 is not None and connections["default"].vendor == "postgresql"
+
+
+def get_connect_kwargs():
+    # The same connection settings Django uses
+    db = settings.DATABASES["default"]
+    kwargs = dict(dbname=db["NAME"], **db.get("OPTIONS", {}))
+    for setting, kwarg in [("USER", "user"), ("PASSWORD", "password"), ("HOST", "host"), ("PORT", "port")]:
+        if db.get(setting):
+            kwargs[kwarg] = db[setting]
+    return kwargs
+
+
+async def wait(conn):
+    # Drive an async psycopg2 connection until it's done what it was asked, waiting for its socket on the event loop
+    loop = asyncio.get_event_loop()
+    while True:
+        state = conn.poll()
+        if state == POLL_OK:
+            return
+
+        if state == POLL_READ:
+            add, remove = loop.add_reader, loop.remove_reader
+        elif state == POLL_WRITE:
+            add, remove = loop.add_writer, loop.remove_writer
+        else:
+            raise psycopg2.OperationalError(f"Unexpected poll state {state}")
+
+        ready = loop.create_future()
+        fileno = conn.fileno()
+        add(fileno, lambda: ready.done() or ready.set_result(None))
+        try:
+            await ready
+        finally:
+            remove(fileno)
+
+
+def compile_values(queryset):
+    # A .values() queryset -> (its SQL, the SQL's parameters, the names of the columns it returns)
+    query = queryset.query
+    sql, params = query.sql_with_params()
+    return sql, params, [*query.extra_select, *query.values_select, *query.annotation_select]
+
+
+class PreparedQuery:
+    """
+    A .values() query that's built and compiled to SQL once, as doing that takes longer than running it. make(*args)
+    returns the queryset, it's called once with the placeholders (values the query can't otherwise contain) and
+    they're swapped for the real arguments every time it's run
+    """
+
+    def __init__(self, make, *placeholders):
+        self.make = make
+        self.placeholders = placeholders
+        self.compiled = None
+
+    def bind(self, *args):
+        if self.compiled is None:
+            sql, params, names = compile_values(self.make(*self.placeholders))
+            # Which argument each parameter is, or None if it's part of the query
+            arguments = [self.placeholders.index(param) if param in self.placeholders else None for param in params]
+            if set(arguments) - {None} != set(range(len(self.placeholders))):
+                raise ValueError(f"Couldn't find every placeholder in {sql}")
+            self.compiled = sql, params, arguments, names
+
+        sql, params, arguments, names = self.compiled
+        return sql, [param if index is None else args[index] for param, index in zip(params, arguments)], names
+
+
+class AsyncPool:
+    def __init__(self, size, timeout):
+        self.size = size
+        self.timeout = timeout
+        self.free = []
+        self.semaphore = None  # Created on first use, so it belongs to the server's event loop
+
+    async def connect(self):
+        conn = psycopg2.connect(**get_connect_kwargs(), async_=True)
+        await wait(conn)
+        return conn
+
+    async def fetch(self, query, *args):
+        """Runs a .values() queryset (or a PreparedQuery with args), returns the rows as dicts like the ORM would"""
+        sql, params, names = query.bind(*args) if isinstance(query, PreparedQuery) else compile_values(query)
+
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.size)
+
+        async with self.semaphore:
+            conn = self.free.pop() if self.free else None
+            try:
+                if conn is None:
+                    conn = await asyncio.wait_for(self.connect(), self.timeout)
+
+                cursor = conn.cursor()
+                cursor.execute(sql, params)
+                await asyncio.wait_for(wait(conn), self.timeout)
+                rows = cursor.fetchall()
+                cursor.close()
+            except BaseException:
+                # We don't know what state it's in (eg. the query timed out), so don't reuse it
+                if conn is not None:
+                    conn.close()
+                raise
+
+            self.free.append(conn)
+
+        return [dict(zip(names, row)) for row in rows]
+
+    def close(self):
+        while self.free:
+            self.free.pop().close()
+
+
+pool = AsyncPool(size=settings.ASYNC_DB_POOL_SIZE, timeout=settings.ASYNC_DB_TIMEOUT)
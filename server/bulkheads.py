@@ -0,0 +1,106 @@
+# Separate thread pools ("bulkheads") for each class of route. All our sync work (etebase's endpoints, Django, and
+# the DB lookups in our middleware) used to share one pool, so a burst of slow Stripe calls could use up every thread
+# and stall etebase syncing. Now each class of route has its own pool, sized in BULKHEAD_WORKERS, and can only ever
+# use up its own threads. Each pool keeps count of what's waiting for a thread and how long it waited
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from loguru import logger
+
+# (Path prefix, route class), the first match wins
+ROUTE_CLASSES = [
+    ("/django/api/billing/webhook", "webhooks"),
+    ("/django/api/billing", "billing"),
+    ("/django/api", "api"),
+    ("/django", "admin"),
+    ("/etebase", "etebase"),
+]
+DEFAULT_ROUTE_CLASS = "etebase"  # Also what runs on the event loop's default executor (see use_bulkheads)
+
+
+class Bulkhead(ThreadPoolExecutor):
+    """A ThreadPoolExecutor that keeps track of how many tasks are queued or running, and how long they waited"""
+
+    def __init__(self, name, workers):
+        super().__init__(max_workers=workers, thread_name_prefix=f"bulkhead-{name}")
+        self.name = name
+        self.workers = workers
+
+        self.queued = 0
+        self.running = 0
+        self.completed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.slow_waits = 0
+        self._stats_lock = threading.Lock()
+
+    def submit(self, fn, *args, **kwargs):
+        with self._stats_lock:
+            self.queued += 1
+        return super().submit(self._run, time.monotonic(), fn, *args, **kwargs)
+
+    def _run(self, submitted_at, fn, *args, **kwargs):
+        wait = time.monotonic() - submitted_at
+        with self._stats_lock:
+            self.queued -= 1
+            self.running += 1
+            self.total_wait += wait
+            self.max_wait = max(self.max_wait, wait)
+            if wait > settings.BULKHEAD_SLOW_WAIT:
+                self.slow_waits += 1
+                slow_waits = self.slow_waits
+            else:
+                slow_waits = 0
+
+        if slow_waits % 100 == 1:
+            logger.warning(f"The {self.name} pool is busy, waited {wait:.2f}s for a thread - {self.stats()}")
+
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._stats_lock:
+                self.running -= 1
+                self.completed += 1
+
+    async def run(self, fn, *args):
+        # Like starlette's run_in_threadpool, but on this pool. The context (eg. the request's auth) goes with it
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self, contextvars.copy_context().run, functools.partial(fn, *args))
+
+    def stats(self):
+        with self._stats_lock:
+            return dict(
+                name=self.name,
+                workers=self.workers,
+                queued=self.queued,
+                running=self.running,
+                completed=self.completed,
+                avg_wait=self.total_wait / self.completed if self.completed else 0.0,
+                max_wait=self.max_wait,
+                slow_waits=self.slow_waits,
+            )
+
+
+bulkheads = {name: Bulkhead(name, workers) for name, workers in settings.BULKHEAD_WORKERS.items()}
+
+
+def get_bulkhead(path):
+    for prefix, route_class in ROUTE_CLASSES:
+        if path.startswith(prefix):
+            return bulkheads[route_class]
+    return bulkheads[DEFAULT_ROUTE_CLASS]
+
+
+def use_bulkheads():
+    # etebase (a FastAPI app) runs its sync endpoints on the event loop's default executor, which we can't change
+    # per route, so that becomes etebase's pool. Everything of ours picks its pool with get_bulkhead
+    asyncio.get_event_loop().set_default_executor(bulkheads[DEFAULT_ROUTE_CLASS])
+
+
+def get_stats():
+    return [bulkhead.stats() for bulkhead in bulkheads.values()]
@@ -0,0 +1,95 @@
+import threading
+import time
+from collections import OrderedDict
+
+from loguru import logger
+
+_MISSING = object()
+
+caches = []  # Every TTLCache, for get_stats
+
+
+class TTLCache:
+    """
+    A small, thread-safe, process-local LRU cache where every entry also expires after `ttl` seconds.
+    Django requests run on a thread pool so everything goes through a lock.
+    """
+
+    def __init__(self, name: str, max_size: int, ttl: float):
+        self.name = name
+        self.max_size = max_size
+        self.ttl = ttl
+
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        caches.append(self)
+
+    def get(self, key, default=None):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+
+            expires_at, value = entry
+            if expires_at <= now:
+                del self._data[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl: float = None):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._data[key] = (expires_at, value)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def delete_where(self, predicate):
+        # predicate(key, value) -> bool. This is O(size), which is fine as the cache is bounded
+        with self._lock:
+            keys = [key for key, (_, value) in self._data.items() if predicate(key, value)]
+            for key in keys:
+                del self._data[key]
+
+        if keys:
+            logger.debug(f"Invalidated {len(keys)} entries from the {self.name} cache")
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                name=self.name,
+                size=len(self._data),
+                max_size=self.max_size,
+                hits=self.hits,
+                misses=self.misses,
+                hit_rate=self.hits / (self.hits + self.misses) if self.hits + self.misses else 0.0,
+                evictions=self.evictions,
+                expirations=self.expirations,
+            )
+
+
+def get_stats():
+    return [cache.stats() for cache in caches]
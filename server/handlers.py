@@ -0,0 +1,85 @@
+# Serves Django (the admin and the Ninja API) over ASGI directly, rather than through Starlette's WSGIMiddleware,
+# which turned every request into a WSGI environ and buffered the whole request and response in memory.
+# Django 3.1's own ASGIHandler runs sync views and middleware with thread_sensitive=True, ie. all on one thread per
+# process, which would serialise the API. So each request is handled on a thread from its route's pool instead
+# (see server/bulkheads.py), and
+# everything for that request (the request signals, the view, streaming the body, closing the response) happens on
+# that one thread, as it did under WSGI, so DB connections are opened, used and cleaned up on the same thread.
+# Only streamed bodies are sent from that thread, everything else is handed back to the event loop to send
+import asyncio
+
+from django.core import signals
+from django.core.exceptions import RequestAborted
+from django.core.handlers import base
+from django.core.handlers.asgi import ASGIHandler
+from django.http import FileResponse
+from django.urls import set_script_prefix
+
+from server.bulkheads import get_bulkhead
+
+
+class DjangoHandler(ASGIHandler):
+    def __init__(self):
+        base.BaseHandler.__init__(self)
+        self.load_middleware()  # The sync middleware chain, as views run on a thread
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            raise ValueError(f"Django can only handle ASGI/HTTP connections, not {scope['type']}.")
+
+        try:
+            body_file = await self.read_body(receive)
+        except RequestAborted:
+            return
+
+        bulkhead = get_bulkhead(scope.get("root_path", "") + scope["path"])
+        messages = await bulkhead.run(self.handle, scope, body_file, send, asyncio.get_event_loop())
+        for message in messages:
+            await send(message)
+
+    def handle(self, scope, body_file, send, loop):
+        set_script_prefix(self.get_script_prefix(scope))
+        signals.request_started.send(sender=self.__class__, scope=scope)
+
+        request, response = self.create_request(scope, body_file)
+        if request is not None:
+            response = self.get_response(request)
+
+        response._handler_class = self.__class__
+        if isinstance(response, FileResponse):
+            response.block_size = self.chunk_size
+
+        try:
+            if response.streaming:
+                # These make their body as they're sent (eg. GET /team queries the DB as it goes), so that has to
+                # happen here too
+                for message in self.response_messages(response):
+                    asyncio.run_coroutine_threadsafe(send(message), loop).result()
+                return []
+
+            # The body is already made, so we're done with the response and the event loop can send it
+            return list(self.response_messages(response))
+        finally:
+            response.close()  # Sends request_finished
+
+    def response_messages(self, response):
+        # The same messages as ASGIHandler.send_response
+        headers = [
+            (
+                header.encode("ascii") if isinstance(header, str) else header,
+                value.encode("latin1") if isinstance(value, str) else value,
+            )
+            for header, value in response.items()
+        ]
+        headers += [(b"Set-Cookie", c.output(header="").encode("ascii").strip()) for c in response.cookies.values()]
+
+        yield {"type": "http.response.start", "status": response.status_code, "headers": headers}
+
+        if response.streaming:
+            for part in response:
+                for chunk, _ in self.chunk_bytes(part):
+                    yield {"type": "http.response.body", "body": chunk, "more_body": True}
+            yield {"type": "http.response.body"}
+        else:
+            for chunk, last in self.chunk_bytes(response.content):
+                yield {"type": "http.response.body", "body": chunk, "more_body": not last}
@@ -0,0 +1,115 @@
+# Transactional email goes through an outbox rather than being sent during the request. queue_email() writes an
+# OutgoingEmail row (call it in the same transaction as whatever the email is about), and send_queued_emails() sends
+# them in the background, in batches, retrying with backoff if SendGrid fails
+import random
+from datetime import datetime, timedelta, timezone
+
+import requests
+from django.conf import settings
+from django.db import transaction
+from loguru import logger
+
+import server.emails as email_template
+from myauth.models import OutgoingEmail
+
+FROM_EMAIL = "contact@gliff.ai"
+SENDGRID_URL = "https://api.sendgrid.com/v3/mail/send"
+
+# One session per process so we reuse connections to SendGrid
+session = requests.Session()
+
+
+def queue_email(to_email, template, data=None):
+    # template is one of the names in server/emails.py
+    return OutgoingEmail.objects.create(
+        to_email=to_email,
+        template_id=email_template.id[template],
+        template_data=data,
+        send_after=datetime.now(tz=timezone.utc),
+    )
+
+
+def get_retry_delay(attempts):
+    # Exponential backoff with some jitter, so a SendGrid outage doesn't get everything retrying at once
+    delay = min(settings.EMAIL_RETRY_BASE_DELAY * 2 ** (attempts - 1), settings.EMAIL_RETRY_MAX_DELAY)
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+def claim_emails(batch_size):
+    now = datetime.now(tz=timezone.utc)
+
+    with transaction.atomic():
+        # skip_locked lets several processes drain the outbox without sending anything twice
+        emails = list(
+            OutgoingEmail.objects.select_for_update(skip_locked=True)
+            .filter(sent_date__isnull=True, send_after__lte=now, attempts__lt=settings.EMAIL_MAX_ATTEMPTS)
+            .order_by("send_after")[:batch_size]
+        )
+
+        # If we die before sending these, they'll be picked up again when this runs out
+        OutgoingEmail.objects.filter(id__in=[email.id for email in emails]).update(
+            send_after=now + timedelta(seconds=settings.EMAIL_SEND_TIMEOUT * 2)
+        )
+
+    return emails
+
+
+def send_batch(template_id, emails):
+    # SendGrid takes up to 1000 recipients (each with their own template data) in a single request
+    personalizations = []
+    for email in emails:
+        personalization = {"to": [{"email": email.to_email}]}
+        if email.template_data:
+            personalization["dynamic_template_data"] = email.template_data
+        personalizations.append(personalization)
+
+    response = session.post(
+        SENDGRID_URL,
+        json={"from": {"email": FROM_EMAIL}, "template_id": template_id, "personalizations": personalizations},
+        headers={"Authorization": f"Bearer {settings.SENDGRID_API_KEY}"},
+        timeout=settings.EMAIL_SEND_TIMEOUT,
+    )
+    response.raise_for_status()
+
+
+def send_template(template_id, batch):
+    ids = [email.id for email in batch]
+    attempts = max(email.attempts for email in batch) + 1
+
+    try:
+        send_batch(template_id, batch)
+    except Exception as e:
+        # One bad address fails the whole request, so try them one at a time
+        if isinstance(e, requests.HTTPError) and e.response.status_code == 400 and len(batch) > 1:
+            return sum(send_template(template_id, [email]) for email in batch)
+
+        logger.error(f"Error sending {len(batch)} email(s) with template {template_id} (attempt {attempts}) - {e}")
+
+        OutgoingEmail.objects.filter(id__in=ids).update(
+            attempts=attempts,
+            last_error=str(e),
+            send_after=datetime.now(tz=timezone.utc) + get_retry_delay(attempts),
+        )
+
+        if attempts >= settings.EMAIL_MAX_ATTEMPTS:
+            logger.error(f"Giving up on email(s) {ids}")
+
+        return 0
+
+    OutgoingEmail.objects.filter(id__in=ids).update(sent_date=datetime.now(tz=timezone.utc), attempts=attempts)
+    return len(batch)
+
+
+def send_queued_emails(batch_size=None):
+    emails = claim_emails(batch_size or settings.EMAIL_BATCH_SIZE)
+
+    batches = dict()
+    for email in emails:
+        batches.setdefault(email.template_id, []).append(email)
+
+    sent = sum(send_template(template_id, batch) for template_id, batch in batches.items())
+
+    if sent:
+        logger.info(f"Sent {sent} queued email(s)")
+
+    return sent
@@ -134,8 +134,74 @@ BASE_URL = config("BASE_URL", default="http://localhost:3000")
 SUCCESS_URL = config("SUCCESS_URL", default="http://localhost:3000/signup/success")
 CANCEL_URL = config("CANCEL_URL", default="http://localhost:3000/signup/cancel")
 
+# Authenticated users are cached per token (see server/api/auth.py)
+AUTH_CACHE_TTL = config("AUTH_CACHE_TTL", default=60, cast=int)  # seconds
+AUTH_CACHE_MAX_SIZE = config("AUTH_CACHE_MAX_SIZE", default=2048, cast=int)
+
+# Stripe prices and subscriptions are cached (see server/api/billing.py)
+STRIPE_PRICE_CACHE_TTL = config("STRIPE_PRICE_CACHE_TTL", default=60 * 60, cast=int)  # seconds
+STRIPE_SUBSCRIPTION_CACHE_TTL = config("STRIPE_SUBSCRIPTION_CACHE_TTL", default=5 * 60, cast=int)  # seconds
+STRIPE_CACHE_MAX_SIZE = config("STRIPE_CACHE_MAX_SIZE", default=1024, cast=int)
+STRIPE_TIMEOUT = config("STRIPE_TIMEOUT", default=10, cast=int)  # seconds, for each call to Stripe
+STRIPE_MAX_CONCURRENCY = config("STRIPE_MAX_CONCURRENCY", default=8, cast=int)  # calls at once, per process
+STRIPE_RATE_LIMIT = config("STRIPE_RATE_LIMIT", default=20, cast=int)  # calls a second, for bulk jobs
+STRIPE_MAX_RETRIES = 4  # when we're rate limited or can't connect, in bulk jobs
+
+# Frontend Sentry events are queued and forwarded in the background (see server/api/sentry.py)
+SENTRY_TUNNEL_QUEUE_SIZE = config("SENTRY_TUNNEL_QUEUE_SIZE", default=1000, cast=int)  # events, per process
+SENTRY_TUNNEL_WORKERS = config("SENTRY_TUNNEL_WORKERS", default=4, cast=int)  # events sent at once, per process
+SENTRY_TUNNEL_MAX_SIZE = 1024 * 1024  # bytes
+SENTRY_TUNNEL_CONNECT_TIMEOUT = 2  # seconds
+SENTRY_TUNNEL_TIMEOUT = 5  # seconds
+SENTRY_TUNNEL_RETRY_AFTER = 30  # seconds the frontend should wait when the queue is full
+
+# Threads for each class of route, so one can't use up another's (see server/bulkheads.py)
+BULKHEAD_WORKERS = {
+    "etebase": config("BULKHEAD_ETEBASE_WORKERS", default=16, cast=int),
+    "api": config("BULKHEAD_API_WORKERS", default=12, cast=int),
+    "billing": config("BULKHEAD_BILLING_WORKERS", default=6, cast=int),
+    "webhooks": config("BULKHEAD_WEBHOOK_WORKERS", default=4, cast=int),
+    "admin": config("BULKHEAD_ADMIN_WORKERS", default=2, cast=int),
+}
+BULKHEAD_SLOW_WAIT = 1  # seconds waiting for a thread before we warn that a pool is busy
+
+# How often each process logs its stats (see server/stats.py), 0 to turn it off
+STATS_LOG_INTERVAL = config("STATS_LOG_INTERVAL", default=5 * 60, cast=int)  # seconds
+
+# Connections our middleware uses to query Postgres without a thread, per process (see server/asyncdb.py)
+ASYNC_DB_POOL_SIZE = config("ASYNC_DB_POOL_SIZE", default=4, cast=int)
+ASYNC_DB_TIMEOUT = 5  # seconds, to connect or run a query
+
+# Each team's GET /plugin response is cached (see server/api/plugin.py)
+PLUGIN_CACHE_TTL = config("PLUGIN_CACHE_TTL", default=5 * 60, cast=int)  # seconds
+PLUGIN_CACHE_MAX_SIZE = config("PLUGIN_CACHE_MAX_SIZE", default=1024, cast=int)
+
+# The public tier list is built once and kept in memory (see server/api/tier.py)
+TIER_CATALOG_TTL = config("TIER_CATALOG_TTL", default=10 * 60, cast=int)  # seconds
+TIER_CATALOG_MAX_AGE = 60  # seconds browsers/CDNs can reuse it without asking
+
+TEAM_PAGE_MAX_SIZE = 500  # Most rows GET /team will return at once
+
+# Queued emails (see server/outbox.py)
+EMAIL_BATCH_SIZE = 100  # SendGrid allows up to 1000 recipients per request
+EMAIL_DISPATCH_INTERVAL = 5  # seconds between checking for emails to send
+EMAIL_SEND_TIMEOUT = 10  # seconds
+EMAIL_MAX_ATTEMPTS = 8
+EMAIL_RETRY_BASE_DELAY = 30  # seconds, doubled after each failed attempt
+EMAIL_RETRY_MAX_DELAY = 60 * 60  # seconds
+
+# The nightly storage scan remembers what it saw last time here (see myauth/storage.py)
+STORAGE_MANIFEST_PATH = config("STORAGE_MANIFEST_PATH", default=os.path.join(MEDIA_ROOT, ".storage_manifest.json"))
+STORAGE_SCAN_WORKERS = config("STORAGE_SCAN_WORKERS", default=None, cast=lambda v: v and int(v))  # default: 1 per CPU
+
+# Usage history is kept daily for this long, then weekly, then monthly (see myauth/usage.py)
+USAGE_DAILY_RETENTION_DAYS = config("USAGE_DAILY_RETENTION_DAYS", default=90, cast=int)
+USAGE_WEEKLY_RETENTION_DAYS = config("USAGE_WEEKLY_RETENTION_DAYS", default=365, cast=int)
+USAGE_PARTITIONS_AHEAD = 3  # months of Usage partitions to create in advance, on Postgres
+
 # vars used in background tasks
 RUN_TASK_UPDATE_STORAGE = False
+RUN_TASK_SEND_EMAILS = True
 
 TEST_MODE = False
 
@@ -0,0 +1,46 @@
+# Each process logs how its thread pools and caches are doing every STATS_LOG_INTERVAL seconds, so there's a record of
+# how long requests waited for a thread (see server/bulkheads.py) and how often the caches (eg. of Stripe prices and
+# subscriptions, see server/cache.py) saved a trip, without anything having to ask for it
+import asyncio
+
+from django.conf import settings
+from loguru import logger
+
+from server import bulkheads, cache
+
+_task = None
+
+
+def format_stats(stats):
+    return " ".join(
+        f"{key}={value:.3f}" if isinstance(value, float) else f"{key}={value}" for key, value in stats.items()
+    )
+
+
+def log_stats():
+    for stats in bulkheads.get_stats():
+        logger.info(f"Pool stats: {format_stats(stats)}")
+    for stats in cache.get_stats():
+        logger.info(f"Cache stats: {format_stats(stats)}")
+
+
+async def log_stats_forever():
+    while True:
+        await asyncio.sleep(settings.STATS_LOG_INTERVAL)
+        try:
+            log_stats()
+        except Exception as e:
+            logger.warning(f"Received Exception {e}")
+
+
+def start_logging_stats():
+    global _task
+    if settings.STATS_LOG_INTERVAL and _task is None:
+        _task = asyncio.ensure_future(log_stats_forever())
+
+
+def stop_logging_stats():
+    global _task
+    if _task is not None:
+        _task.cancel()
+        _task = None
@@ -0,0 +1,74 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from unittest import mock, skipUnless
+
+from django.test import TransactionTestCase
+from django_etebase.token_auth.models import AuthToken
+
+from myauth.counters import rebuild_team_counters
+from myauth.models import Invite, Team, Tier, User, UserProfile
+from server import asyncdb
+from server.api.auth import RequestAuth
+from server.api.billing import calculate_limits
+from server.api.middleware import helpers
+
+
+@skipUnless(asyncdb.is_available(), "The async queries only run on Postgres")
+class AsyncQueriesTest(TransactionTestCase):
+    """
+    get_profile and get_team_limits through asyncdb should give what the ORM does on a thread. A
+    TransactionTestCase, as the pool's connections only see committed rows
+    """
+
+    def setUp(self):
+        self.tier = Tier.objects.create(
+            name="Test", base_user_limit=2, base_project_limit=3, base_collaborator_limit=1, base_storage_limit=100
+        )
+        owner = User.objects.create_user("owner@example.com", "owner@example.com")
+        collaborator = User.objects.create_user("collaborator@example.com", "collaborator@example.com")
+        self.team = Team.objects.create(name="Test", owner=owner, tier=self.tier, usage=7)
+        UserProfile.objects.create(user=owner, name="Owner", team=self.team)
+        UserProfile.objects.create(user=collaborator, name="Collaborator", team=self.team, is_collaborator=True)
+        Invite.objects.create(uid="invite-xxxxxxxxxxxxxxxxxx", from_team=self.team, email="invite@example.com")
+        rebuild_team_counters([self.team.id])  # Without them, get_team_limits leaves it to calculate_limits
+
+        tomorrow, yesterday = [datetime.now(tz=timezone.utc) + timedelta(days=days) for days in (1, -1)]
+        AuthToken.objects.create(user=owner, key="owner", expiry=tomorrow)
+        AuthToken.objects.create(user=collaborator, key="collaborator", expiry=None)
+        AuthToken.objects.create(user=owner, key="expired", expiry=yesterday)
+
+    def tearDown(self):
+        # Its connections and semaphore belong to the test's event loop
+        asyncdb.pool.close()
+        asyncdb.pool.semaphore = None
+
+    def run_async(self, coroutine):
+        # Any thread means we fell back to the ORM
+        with mock.patch.object(helpers, "get_bulkhead", side_effect=AssertionError("Fell back to a thread")):
+            return asyncio.run(coroutine)
+
+    def get_profile(self, key):
+        return self.run_async(helpers.get_profile({"path": "/etebase/api/v1/collection/"}, RequestAuth(key)))
+
+    def test_get_profile(self):
+        for key, is_collaborator in [("Token owner", False), ("Token collaborator", True)]:
+            with self.subTest(key=key):
+                profile = self.get_profile(key)
+                self.assertEqual(profile.is_collaborator, is_collaborator)
+                self.assertEqual(profile.team_id, self.team.id)
+                self.assertEqual(profile.team.usage, 7)
+                self.assertEqual(profile.team.tier.id, self.tier.id)
+                self.assertEqual(profile.team.tier.base_project_limit, 3)
+
+        for key in ["Token expired", "Token unknown"]:
+            with self.subTest(key=key):
+                self.assertIsNone(self.get_profile(key))
+
+    def test_get_team_limits(self):
+        profile = self.get_profile("Token owner")
+        for limit in ["users", "collaborators", "projects"]:
+            with self.subTest(limit=limit):
+                limits = self.run_async(helpers.get_team_limits({"path": "/django/api/team/"}, profile, limit))
+                expected = calculate_limits(self.team, [limit])
+                for field in ["has_billing", limit, f"{limit}_limit"]:
+                    self.assertEqual(limits[field], expected[field])
@@ -0,0 +1,60 @@
+import json
+
+from django.test import TestCase
+from django_etebase.token_auth.models import AuthToken
+
+from myauth.models import Invite, Team, Tier, User, UserProfile
+from server.api.auth import token_cache
+
+
+class GetTeamQueriesTest(TestCase):
+    """GET /team should make the same number of queries however big the team is"""
+
+    def setUp(self):
+        self.tier = Tier.objects.create(name="Test")
+
+    def make_team(self, size, invites):
+        users = [User.objects.create_user(f"user{i}@example.com", f"user{i}@example.com") for i in range(size)]
+        team = Team.objects.create(name="Test", owner=users[0], tier=self.tier, usage=0)
+        for i, user in enumerate(users):
+            UserProfile.objects.create(user=user, name=f"User {i}", team=team, is_collaborator=i % 3 == 2)
+        for i in range(invites):
+            Invite.objects.create(uid=f"invite-{i}-xxxxxxxxxxxxxxxx", from_team=team, email=f"invite{i}@example.com")
+
+        # Ask as a member who isn't the owner, so the owner has to be loaded too
+        member = users[1] if size > 1 else users[0]
+        return AuthToken.objects.create(user=member, key=f"token-{team.id}")
+
+    def get_team(self, token, queries, **params):
+        token_cache.clear()  # So every request looks its token up, rather than only the first
+        with self.assertNumQueries(queries):
+            response = self.client.get("/api/team/", params, HTTP_AUTHORIZATION=f"Token {token.key}")
+            body = json.loads(response.getvalue())  # The body is streamed, so the queries happen as it's read
+
+        self.assertEqual(response.status_code, 200)
+        return body
+
+    def clear(self):
+        Invite.objects.all().delete()
+        UserProfile.objects.all().delete()
+        Team.objects.all().delete()
+        User.objects.all().delete()
+
+    def test_constant_queries(self):
+        # The token, the requester's profile (with its team, tier and owner), then the profiles and invites
+        for size, invites in [(1, 0), (2, 1), (10, 5), (50, 20)]:
+            with self.subTest(size=size, invites=invites):
+                self.clear()
+                body = self.get_team(self.make_team(size, invites), 4)
+                self.assertEqual(len(body["profiles"]), size)
+                self.assertEqual(len(body["pending_invites"]), invites)
+                self.assertEqual(body["owner"]["email"], "user0@example.com")
+
+    def test_constant_queries_paged(self):
+        # A page that's all profiles never gets as far as the invites
+        for size in [10, 50]:
+            with self.subTest(size=size):
+                self.clear()
+                body = self.get_team(self.make_team(size, 5), 3, limit=5)
+                self.assertEqual(len(body["profiles"]), 5)
+                self.assertIsNotNone(body["next_cursor"])
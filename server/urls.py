@@ -13,8 +13,8 @@ from ninja.security import APIKeyHeader
 from myauth.models import TrustedService
 from myauth.models import Plugin
 
-from etebase_fastapi.dependencies import get_authenticated_user
-
+from .api.auth import get_request_auth
+from .api.renderers import ORJSONRenderer
 from .api.user import router as users_router
 from .api.tier import router as tiers_router
 from .api.team import router as teams_router
@@ -22,7 +22,6 @@ from .api.project import router as project_router
 from .api.billing import router as billing_router
 from .api.trusted_service import router as trusted_service_router
 from .api.plugin import router as plugin_router
-from .api.sentry import router as sentry_router
 from .api.feedback import router as feedback_router
 
 
@@ -34,14 +33,15 @@ class ApiKey(APIKeyHeader):
             if key is None:
                 return False
 
-            user = get_authenticated_user(key)  # Validate with Etebase
-            return user
+            # Validate with Etebase, reusing the user ResolveAuthMiddleware already looked up for this request
+            user = get_request_auth(key).user
+            return user or False
         except Exception as e:
             logger.warning(f"Received Exception {e}")
             return False
 
 
-api = NinjaAPI(auth=ApiKey())
+api = NinjaAPI(auth=ApiKey(), renderer=ORJSONRenderer())
 
 
 @api.get("/", auth=None)
@@ -57,7 +57,6 @@ api.add_router("/user", users_router)
 api.add_router("/team", teams_router)
 api.add_router("/billing", billing_router)
 api.add_router("/project", project_router)
-api.add_router("/tunnel", sentry_router)
 api.add_router("/trusted_service", trusted_service_router)
 api.add_router("/plugin", plugin_router)
 api.add_router("/feedback", feedback_router)
@@ -64,6 +64,10 @@ if settings.RUN_TASK_UPDATE_STORAGE:
     # run background task for updating all team's storage usage
     management.call_command("update_team_storage_usage")
 
+if settings.RUN_TASK_SEND_EMAILS:
+    # send queued emails in the background
+    management.call_command("send_queued_emails")
+
 if __name__ == "__main__":
     # initialise uvicorn server
     server = Server(